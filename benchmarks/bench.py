@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+# Micro-benchmarks of the refresh and request paths, run offline against recorded copies of
+# the metservice.intnet.mu tides page (benchmarks/fixtures/*.html and, if present, the last
+# page saved by the tool: metservice.intnet.mu.html).
+#
+# Each case runs in its own process and reports:
+# - wall time per call (median and min of several runs),
+# - Python allocations during one run (tracemalloc: peak and retained KiB),
+# - peak RSS of the process.
+# Results are compared with a baseline file (benchmarks/baseline.json by default).
+
+import argparse
+import contextlib
+from datetime import datetime
+import glob
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR  = os.path.dirname(BENCH_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+MIN_RUN_TIME     = 0.1	# seconds. Number of calls per run is calibrated to last at least this
+
+# name: description
+CASES = {
+    'parse.fast'          : 'tides table extraction, streaming parser (per page)',
+    'parse.bs4'           : 'tides table extraction, BeautifulSoup parser (per page)',
+    'refresh.ingest'      : '_parseTidesPage(): extraction, tides history and cache file update (per page)',
+    'cache.load'          : 'loadDataFromCacheFile() (per load)',
+    'snapshot.load'       : 'binary snapshot mapping and first lookup (per load)',
+    'lookup.getTidesInfo' : 'getTidesInfo() (per date)',
+    'lookup.history'      : 'tides history point lookup (per date)',
+    'show.short'          : 'showTidesInfo() (per date)',
+    'show.verbose'        : 'showTidesInfo(), verbose output (per date)',
+    'curve.day'           : 'interpolated water heights of a day, 5 minutes step (per date)',
+    'stats.build'         : 'statistics table build and month statistics (per build)',
+}
+
+# Return the list of fixtures available
+def defaultFixtures():
+    l = sorted(glob.glob(os.path.join(BENCH_DIR, 'fixtures', '*.html')))
+    recorded = os.path.join(ROOT_DIR, 'metservice.intnet.mu.html')
+    if os.path.isfile(recorded):
+        l.append(recorded)
+    return l
+
+
+####
+# Case setup, in the benchmark process. Return (function, number of items processed per call)
+def _setupCase(case, fixture, workDir):
+    sys.path.insert(0, ROOT_DIR)
+    import config
+    import myGlobals as mg
+
+    config.DEBUG       = 0
+    config.VERBOSE     = False
+    config.UPDATEDELAY = 1440
+    config.MAX_STALENESS = 10080
+    config.PARSER      = 'fast'
+
+    # Cache file and tides history in a scratch directory
+    mg.moduleDirPath = workDir
+    mg.dataCachePath = os.path.join(workDir, mg.DATA_CACHE_FILE)
+    mg.dataStorePath = os.path.join(workDir, mg.DATA_STORE_FILE)
+    os.chdir(workDir)
+
+    import tides as mst
+    import tidesParser as tp
+    from tidesClock import FrozenClock, setClock
+
+    with open(fixture, 'r') as f:
+        html = f.read()
+
+    # The page is parsed as if it was read during its first month (mid-month, at noon)
+    month = next(tp.iterTableRows(html))[0].replace("'", "").split()[0]
+    year = mst.getClock().today().year
+    setClock(FrozenClock(datetime.strptime('15 %s %d 12:00' % (month, year), '%d %B %Y %H:%M')))
+
+    parser = mst.MetServiceTides(None)
+    # Extraction only (rows of the table and TideDay records): no disk I/O
+    if case.startswith('parse.'):
+        config.PARSER = case.split('.')[1]
+        return (lambda: parser._extractTides(html)), 1
+
+    if case == 'refresh.ingest':
+        return (lambda: parser._parseTidesPage(html)), 1
+
+    # Other cases use the cache file and history created from the fixture
+    data = parser._parseTidesPage(html)
+    keys = sorted(data)
+
+    if case == 'cache.load':
+        return mst.loadDataFromCacheFile, 1
+
+    if case == 'snapshot.load':
+        def run():
+            mst.readCache()[1].get(keys[0])
+        return run, 1
+
+    if case == 'lookup.getTidesInfo':
+        def run():
+            for k in keys:
+                mst.getTidesInfo(k)
+        return run, len(keys)
+
+    if case == 'lookup.history':
+        store = mst.getStore()
+        def run():
+            for k in keys:
+                store.get(k)
+        return run, len(keys)
+
+    if case.startswith('show.'):
+        config.VERBOSE = case == 'show.verbose'
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for k in keys:
+                    mst.showTidesInfo(k)
+        return run, len(keys)
+
+    if case == 'curve.day':
+        mst.getTidesCurve(keys[0], 300)	# Build timeline and curve
+        def run():
+            for k in keys:
+                mst.getTidesCurve(k, 300)
+        return run, len(keys)
+
+    if case == 'stats.build':
+        day = mst.getTidesInfo(keys[0]).date
+        def run():
+            mst._resetTimeline(None)	# Statistics are memoized: rebuild them
+            mst.getTidesStats(day.year, day.month)
+        return run, 1
+
+    raise ValueError('Unknown case %s' % case)
+
+
+# Run one case in the current process. Return a dict of results
+def runCase(case, fixture, repeat):
+    with tempfile.TemporaryDirectory(prefix='mmms-bench-') as workDir:
+        fn, items = _setupCase(case, fixture, workDir)
+
+        # Warm-up and calibration
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        number = max(1, int(MIN_RUN_TIME / max(elapsed, 1e-9)))
+
+        times = list()
+        for i in range(repeat):
+            t = time.perf_counter()
+            for j in range(number):
+                fn()
+            times.append((time.perf_counter() - t) / (number * items))
+
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'timeUs'         : statistics.median(times) * 1e6,
+            'minUs'          : min(times) * 1e6,
+            'calls'          : number * repeat,
+            'allocPeakKiB'   : (peak - base) / 1024,
+            'allocRetainKiB' : (current - base) / 1024,
+            'rssKiB'         : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,	# KiB on Linux
+        }
+
+
+# Run one case in a child process (fresh interpreter: RSS and imports are not shared between cases)
+def runCaseIsolated(case, fixture, repeat):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', '--case', case, '--fixture', fixture, '--repeat', str(repeat)]
+    p = subprocess.run(cmd, capture_output=True, text=True)
+    if p.returncode:
+        return {'error': p.stderr.strip().splitlines()[-1] if p.stderr.strip() else 'exit code %d' % p.returncode}
+    return json.loads(p.stdout)
+
+
+####
+def _ratio(new, old):
+    if not old:
+        return ''
+    return '%+.1f%%' % ((new - old) * 100 / old)
+
+def report(results, baseline, tolerance):
+    regressions = list()
+    print('%-45s %12s %9s %12s %9s %10s %9s' % ('Case', 'Time (us)', 'vs base', 'Alloc (KiB)', 'vs base', 'RSS (KiB)', 'vs base'))
+    for key, r in results.items():
+        if 'error' in r:
+            print('%-45s ERROR: %s' % (key, r['error']))
+            continue
+        b = baseline.get(key, dict())
+        print('%-45s %12.2f %9s %12.1f %9s %10d %9s' % (key,
+                                                       r['timeUs'], _ratio(r['timeUs'], b.get('timeUs')),
+                                                       r['allocPeakKiB'], _ratio(r['allocPeakKiB'], b.get('allocPeakKiB')),
+                                                       r['rssKiB'], _ratio(r['rssKiB'], b.get('rssKiB'))))
+        if b.get('timeUs') and r['timeUs'] > b['timeUs'] * (1 + tolerance):
+            regressions.append(key)
+    return regressions
+
+
+def parse_argv():
+    parser = argparse.ArgumentParser(description='Parser and lookup micro-benchmarks (offline)')
+    parser.add_argument('-f', '--fixture', dest='fixtures', action='append', default=None, metavar='HTML',
+                        help='recorded tides page to use (may be repeated). Default: benchmarks/fixtures/*.html')
+    parser.add_argument('-c', '--case', dest='cases', action='append', default=None, choices=list(CASES),
+                        help='case to run (may be repeated). Default: all')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5,
+                        help='number of timed runs per case (default=5)')
+    parser.add_argument('-b', '--baseline', dest='baseline', default=DEFAULT_BASELINE,
+                        help='baseline file (default=benchmarks/baseline.json)')
+    parser.add_argument('-s', '--save-baseline', dest='saveBaseline', action='store_true', default=False,
+                        help='save results as the new baseline')
+    parser.add_argument('-t', '--tolerance', dest='tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as a regression (default=0.2)')
+    parser.add_argument('--check', dest='check', action='store_true', default=False,
+                        help='exit with code 1 if a regression is found')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='also save results to this JSON file')
+    parser.add_argument('--child', dest='child', action='store_true', default=False,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_argv()
+
+    # Child process: run a single case and print its results
+    if args.child:
+        print(json.dumps(runCase(args.cases[0], args.fixtures[0], args.repeat)))
+        return 0
+
+    fixtures = args.fixtures or defaultFixtures()
+    if not fixtures:
+        print('No fixture found')
+        return 1
+
+    results = dict()
+    for fixture in fixtures:
+        for case in args.cases or CASES:
+            key = '%s:%s' % (os.path.basename(fixture), case)
+            results[key] = runCaseIsolated(case, os.path.abspath(fixture), args.repeat)
+
+    try:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = dict()
+
+    regressions = report(results, baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.saveBaseline:
+        baseline.update({k: v for k,v in results.items() if 'error' not in v})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+
+    if regressions:
+        print('Regressions (> %d%%): %s' % (args.tolerance * 100, ', '.join(regressions)))
+        if args.check:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+# End-to-end load test of the REST API, run offline
+#
+# - the local simulator of metservice.intnet.mu (benchmarks/metserviceSimulator.py) serves a
+#   synthesized tides page of the current month or a recorded page (-f),
+# - the cache file and tides history are created in a scratch directory from this page, by the
+#   command line tool (-nc), as a refresh would do,
+# - the server (production mode) is started on this cache directory, with the simulator as
+#   upstream, then driven at a set concurrency (threads, one keep-alive connection each) on
+#   /tides (today) and /tides/<id> (dates of the cache file) for a set duration.
+# Reports throughput, latency percentiles, error rate and RSS of the server processes (main
+# process and workers, from /proc). Results are saved as JSON (-o) and can be compared with a
+# previous run (--compare).
+#
+# The client runs in one Python process: with many server workers, check that it is not the
+# bottleneck (CPU usage of this process close to 100%).
+
+import argparse
+from datetime import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from metserviceSimulator import Simulator, synthesizedPage
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR  = os.path.dirname(BENCH_DIR)
+
+API_PATH       = '/mymetservicetides/api/v1.0/tides'
+READY_TIMEOUT  = 30		# seconds. Max delay for the server to answer
+RSS_INTERVAL   = 0.2		# seconds. Sampling period of the RSS of the server processes
+PERCENTILES    = (50, 90, 99, 99.9)
+
+####
+def _freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _tool():
+    return [sys.executable, os.path.join(ROOT_DIR, 'myMetServiceTides.py')]
+
+# Create the cache file and tides history in workDir from the upstream page. Return the dates
+# (ddmmyy) of the cache file
+def prepareCache(workDir, upstreamUrl):
+    cmd = _tool() + ['-nc', '--cache-dir', workDir, '-U', upstreamUrl]
+    p = subprocess.run(cmd, cwd=workDir, capture_output=True, text=True)
+    if p.returncode:
+        raise RuntimeError('Unable to create the cache file: %s' % (p.stdout + p.stderr).strip())
+    with open(os.path.join(workDir, '.tides.metservice.json'), 'r') as f:
+        return sorted(json.load(f)['tides'])
+
+def startServer(args, workDir, upstreamUrl, port):
+    cmd = _tool() + ['-s', '-P', '-b', '127.0.0.1', '-p', str(port),
+                     '-w', str(args.workers), '-t', str(args.threads),
+                     '--cache-dir', workDir, '-U', upstreamUrl]
+    log = open(os.path.join(workDir, 'server.log'), 'w')
+    return subprocess.Popen(cmd, cwd=workDir, stdout=log, stderr=subprocess.STDOUT)
+
+def waitReady(proc, port):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('Server exited with code %d' % proc.returncode)
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', API_PATH)
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError('Server not ready after %d seconds' % READY_TIMEOUT)
+
+def stopServer(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+####
+# RSS (KiB) of a process and its descendants (gunicorn workers), from /proc
+def _children():
+    children = dict()
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % pid, 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, list()).append(int(pid))
+    return children
+
+def treeRssKiB(pid):
+    children = _children()
+    total = 0
+    pids = [pid]
+    while pids:
+        p = pids.pop()
+        pids += children.get(p, [])
+        try:
+            with open('/proc/%d/status' % p, 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return total
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self._pid  = pid
+        self._done = threading.Event()
+        self.peak  = 0
+        self.last  = 0
+
+    def run(self):
+        while not self._done.wait(RSS_INTERVAL):
+            self.last = treeRssKiB(self._pid)
+            self.peak = max(self.peak, self.last)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+####
+# One client: sends requests on a keep-alive connection until 'deadline'. Latencies are
+# recorded after 'warmupEnd'
+def _client(port, todayRatio, dates, seed, warmupEnd, deadline, out):
+    rnd = random.Random(seed)
+    latencies = list()
+    errors = 0
+    conn = None
+    while True:
+        t0 = time.perf_counter()
+        if t0 >= deadline:
+            break
+        path = API_PATH if rnd.random() < todayRatio else '%s/%s' % (API_PATH, rnd.choice(dates))
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            conn.request('GET', path)
+            r = conn.getresponse()
+            r.read()
+            ok = r.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+            if conn is not None:
+                conn.close()
+            conn = None
+        t1 = time.perf_counter()
+        if t0 >= warmupEnd:
+            latencies.append(t1 - t0)
+            errors += not ok
+    if conn is not None:
+        conn.close()
+    out.append((latencies, errors))
+
+def runLoad(args, port, dates):
+    now = time.perf_counter()
+    warmupEnd = now + args.warmup
+    deadline = warmupEnd + args.duration
+
+    out = list()
+    threads = [threading.Thread(target=_client, args=(port, args.todayRatio, dates, args.seed + i, warmupEnd, deadline, out))
+               for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies = sorted(l for res in out for l in res[0])
+    errors = sum(res[1] for res in out)
+    n = len(latencies)
+    res = {
+        'requests'   : n,
+        'errors'     : errors,
+        'errorRate'  : errors / n if n else 0.0,
+        'throughput' : n / args.duration,
+    }
+    if n:
+        res['latencyMs'] = {'mean': sum(latencies) * 1000 / n, 'max': latencies[-1] * 1000}
+        for p in PERCENTILES:
+            res['latencyMs']['p%g' % p] = latencies[min(n - 1, int(n * p / 100))] * 1000
+    return res
+
+
+####
+def _ratio(new, old):
+    if not old:
+        return ''
+    return '(%+.1f%%)' % ((new - old) * 100 / old)
+
+def report(results, previous):
+    prev = previous.get('results', dict()) if previous else dict()
+    prevLat = prev.get('latencyMs', dict())
+    print('Requests     : %d (%d errors, %.2f%%)' % (results['requests'], results['errors'], results['errorRate'] * 100))
+    print('Throughput   : %.1f req/s %s' % (results['throughput'], _ratio(results['throughput'], prev.get('throughput'))))
+    for k,v in sorted(results.get('latencyMs', dict()).items(), key=lambda kv: kv[1]):
+        print('Latency %-5s: %8.2f ms %s' % (k, v, _ratio(v, prevLat.get(k))))
+    print('Server RSS   : %d KiB at start, %d KiB peak %s' % (results['rssStartKiB'], results['rssPeakKiB'], _ratio(results['rssPeakKiB'], prev.get('rssPeakKiB'))))
+
+
+def parse_argv():
+    parser = argparse.ArgumentParser(description='End-to-end load test of the REST API (offline)')
+    parser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=8,
+                        help='number of concurrent clients (default=8)')
+    parser.add_argument('-d', '--duration', dest='duration', type=float, default=10,
+                        help='measurement duration in seconds (default=10)')
+    parser.add_argument('--warmup', dest='warmup', type=float, default=2,
+                        help='warm-up duration in seconds, not measured (default=2)')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                        help='server worker processes (default=1, requires gunicorn if > 1)')
+    parser.add_argument('-t', '--threads', dest='threads', type=int, default=8,
+                        help='server threads per worker (default=8)')
+    parser.add_argument('--today-ratio', dest='todayRatio', type=float, default=0.5,
+                        help='share of requests for today\'s tides, others are for dates of the cache (default=0.5)')
+    parser.add_argument('-f', '--fixture', dest='fixture', default=None, metavar='HTML',
+                        help='tides page served by the simulator (default: synthesized page of the current month)')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='seed of the random choice of requests (default=0)')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='save results to this JSON file (default=loadtest-<time>.json in the current directory)')
+    parser.add_argument('--compare', dest='compare', default=None, metavar='JSON',
+                        help='results of a previous run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_argv()
+    if not 0 <= args.todayRatio <= 1:
+        print('Invalid --today-ratio (0..1)')
+        return 1
+
+    if args.fixture:
+        with open(args.fixture, 'r') as f:
+            page = f.read()
+    else:
+        page = synthesizedPage()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+
+    upstream = Simulator(page)
+    upstreamUrl = upstream.start()
+    with tempfile.TemporaryDirectory(prefix='mmms-load-') as workDir:
+        try:
+            dates = prepareCache(workDir, upstreamUrl)
+            port = _freePort()
+            proc = startServer(args, workDir, upstreamUrl, port)
+            try:
+                waitReady(proc, port)
+                rssStart = treeRssKiB(proc.pid)
+                sampler = RssSampler(proc.pid)
+                sampler.start()
+                print('Server ready (pid %d). %d clients, %g seconds...' % (proc.pid, args.concurrency, args.duration))
+                results = runLoad(args, port, dates)
+                sampler.stop()
+            finally:
+                stopServer(proc)
+        except RuntimeError as e:
+            print(e)
+            return 1
+        finally:
+            upstream.stop()
+
+    results['rssStartKiB'] = rssStart
+    results['rssPeakKiB']  = max(sampler.peak, rssStart)
+    results['rssEndKiB']   = sampler.last or rssStart
+
+    run = {
+        'date'     : datetime.now().isoformat(timespec='seconds'),
+        'host'     : platform.node(),
+        'python'   : platform.python_version(),
+        'cpus'     : os.cpu_count(),
+        'settings' : {k: getattr(args, k) for k in ('concurrency', 'duration', 'warmup', 'workers', 'threads', 'todayRatio', 'fixture', 'seed')},
+        'results'  : results,
+    }
+    report(results, previous)
+
+    output = args.output or 'loadtest-%s.json' % datetime.now().strftime('%Y%m%d-%H%M%S')
+    with open(output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print('Results saved to %s' % output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Generate a synthesized copy of the metservice.intnet.mu tides page
+#
+# The page mimics the layout parsed by MetServiceTides._parseTidesPage(): a first table
+# whose body holds, for each month, a row with the month name, two header rows and one
+# row per day (date, 1st/2nd high tide time and height, 1st/2nd low tide time and height).
+# Tide times follow a semi-diurnal cycle (12h25), heights a spring/neap cycle (14.8 days).
+
+import argparse
+import calendar
+from datetime import date, datetime, timedelta
+import math
+import sys
+
+TIDE_PERIOD     = timedelta(hours=12, minutes=25)
+SPRING_NEAP     = 14.77 * 86400	# seconds
+MEAN_LEVEL      = 40		# cm
+MEAN_AMPLITUDE  = 18		# cm
+REFERENCE_HIGH  = datetime(2022, 1, 1, 3, 17)	# An arbitrary high water
+
+# Return the list of (time, height) of the high (kind='high') or low waters of a day
+def _tides(day, kind):
+    start = datetime.combine(day, datetime.min.time())
+    t = REFERENCE_HIGH if kind == 'high' else REFERENCE_HIGH + TIDE_PERIOD / 2
+    n = math.floor((start - t) / TIDE_PERIOD)
+    t += n * TIDE_PERIOD
+    res = list()
+    while t < start + timedelta(days=1):
+        if t >= start:
+            s = (t - REFERENCE_HIGH).total_seconds()
+            amplitude = MEAN_AMPLITUDE * (1 + 0.45 * math.cos(2 * math.pi * s / SPRING_NEAP))
+            h = MEAN_LEVEL + (amplitude if kind == 'high' else -amplitude)
+            res.append((t.strftime('%H:%M'), '%d' % round(h)))
+        t += TIDE_PERIOD
+    return res
+
+def _cells(day):
+    cells = ['%d' % day.day]
+    for kind in ('high', 'low'):
+        l = _tides(day, kind)[:2]
+        while len(l) < 2:
+            l.append(('-', '-'))	# Only one tide this day
+        for t,h in l:
+            cells += ['&nbsp;%s' % t if t != '-' else t, '&nbsp;%s' % h if h != '-' else h]
+    return cells
+
+# Return the HTML page for given list of (year, month)
+def synthesizePage(months):
+    out = ['<!DOCTYPE html>',
+           '<html><head><meta charset="utf-8"><title>Sun, Moon and Tides - Tides Mauritius</title></head>',
+           '<body><div id="content">',
+           '<!-- Synthesized page (benchmarks/makeFixture.py) -->',
+           '<h2>Tides for Port Louis</h2>',
+           '<table class="tides" border="1"><tbody>']
+    for (y,m) in months:
+        out.append('<tr><td colspan="9" class="month">%s</td></tr>' % calendar.month_name[m])
+        out.append('<tr><td>Date</td><td colspan="4">High Tide</td><td colspan="4">Low Tide</td></tr>')
+        out.append('<tr><td></td>' + '<td>Time</td><td>Height (cm)</td>' * 4 + '</tr>')
+        for d in range(1, calendar.monthrange(y, m)[1] + 1):
+            out.append('<tr>' + ''.join('<td>%s</td>' % c for c in _cells(date(y, m, d))) + '</tr>')
+    out += ['</tbody></table>',
+            '<table class="moon"><tbody><tr><td>New Moon</td><td>29 May</td></tr></tbody></table>',
+            '</div></body></html>']
+    return '\n'.join(out) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthesized metservice.intnet.mu tides page')
+    parser.add_argument('months', nargs='+', metavar='MMYYYY', help='months to include in the page')
+    parser.add_argument('-o', '--output', dest='output', default=None, help='output file (default=stdout)')
+    args = parser.parse_args()
+
+    months = [(int(m[2:]), int(m[:2])) for m in args.months]
+    page = synthesizePage(months)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(page)
+    else:
+        sys.stdout.write(page)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+# Local simulator of metservice.intnet.mu, with latency and fault injection
+#
+# Serves the tides page (recorded with -f, or synthesized by benchmarks/makeFixture.py for the
+# months given with -m, default: current and next month) on the path used by the tool, with
+# ETag / Last-Modified validators (304 on conditional requests). Each request may be delayed
+# (--latency, --jitter) and, at the given rates, fail:
+# - timeout : no response for --hang seconds, then the connection is closed,
+# - error   : 500, 502 or 503 response,
+# - truncate: the body is cut in the middle (announced Content-Length is the full length),
+# - markup  : the page is served with a changed layout (table removed, column removed or
+#             month names changed).
+#
+# Settings can be read and changed while running, and outcomes are counted:
+#     curl http://127.0.0.1:8089/_simulator
+#     curl -X POST 'http://127.0.0.1:8089/_simulator?errorRate=0.5&latency=2'
+#
+# Usage with the tool:
+#     python3 benchmarks/metserviceSimulator.py -m 122022 -m 012023 --error-rate 0.3 &
+#     python3 myMetServiceTides.py -nc -U http://127.0.0.1:8089 --cache-dir /tmp/sim
+#
+# Also used as a module (see benchmarks/loadTest.py): Simulator(page, settings).start()
+
+import argparse
+import email.utils
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR  = os.path.dirname(BENCH_DIR)
+
+PAGE_PATH    = '/sun-moon-and-tides-tides-mauritius.php'	# As requested by the tool (tides.py)
+CONTROL_PATH = '/_simulator'
+DEFAULT_PORT = 8089
+
+# Faults, in the order the rates are applied
+FAULTS = ('timeout', 'error', 'truncate', 'markup')
+
+# name: (type, default)
+SETTINGS = {
+    'latency'      : (float, 0.0),	# seconds, before any response
+    'jitter'       : (float, 0.0),	# seconds, random extra latency (uniform)
+    'hang'         : (float, 60.0),	# seconds without response on a timeout
+    'timeoutRate'  : (float, 0.0),
+    'errorRate'    : (float, 0.0),
+    'truncateRate' : (float, 0.0),
+    'markupRate'   : (float, 0.0),
+    'validators'   : (bool, True),	# ETag / Last-Modified, and 304 on conditional requests
+}
+
+####
+# Changed layouts of the page
+def _noTable(html):
+    return re.sub(r'<table class="tides".*?</table>', '<p>Tides information is temporarily unavailable</p>', html, count=1, flags=re.S)
+
+def _missingColumn(html):
+    return re.sub(r'<td>[^<]*</td></tr>', '</tr>', html)
+
+def _monthNames(html):
+    return re.sub(r'(<td colspan="9" class="month">)[^<]*', r'\1Month', html)
+
+MARKUP_CHANGES = (_noTable, _missingColumn, _monthNames)
+
+
+class Simulator:
+    def __init__(self, page, settings=None, seed=None):
+        self._settings = {k: v[1] for k,v in SETTINGS.items()}
+        self._settings.update(settings or dict())
+        self._lock   = threading.Lock()
+        self._random = random.Random(seed)
+        self.counts  = {k: 0 for k in ('ok', 'notModified', 'notFound') + FAULTS}
+        self.setPage(page)
+        self._httpd  = None
+
+    # Replace the page served (new validators)
+    def setPage(self, page):
+        body = page.encode('utf-8')
+        with self._lock:
+            self._page         = page
+            self._body         = body
+            self._etag         = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+            self._lastModified = email.utils.formatdate(time.time(), usegmt=True)
+
+    def update(self, **settings):
+        with self._lock:
+            for k,v in settings.items():
+                kind = SETTINGS[k][0]
+                self._settings[k] = v.lower() in ('1', 'true', 'yes', 'on') if kind is bool and isinstance(v, str) else kind(v)
+
+    def status(self):
+        with self._lock:
+            return {'settings': dict(self._settings), 'counts': dict(self.counts)}
+
+    # Outcome of a request: (fault or None, delay, random generator)
+    def _draw(self):
+        with self._lock:
+            s = self._settings
+            delay = s['latency'] + self._random.uniform(0, s['jitter'])
+            r = self._random.random()
+            fault = None
+            for f in FAULTS:
+                rate = s[f + 'Rate']
+                if r < rate:
+                    fault = f
+                    break
+                r -= rate
+            return fault, delay, self._random
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    # Start serving in a thread. Return the base URL
+    def start(self, host='127.0.0.1', port=0, verbose=False):
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.simulator = self
+        self._httpd.verbose = verbose
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return 'http://%s:%d' % self._httpd.server_address[:2]
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        sim = self.server.simulator
+        url = urlsplit(self.path)
+        if url.path == CONTROL_PATH:
+            return self._json(200, sim.status())
+        if url.path != PAGE_PATH:
+            sim._count('notFound')
+            return self._send(404, b'Not Found', 'text/plain')
+
+        fault, delay, rnd = sim._draw()
+        time.sleep(delay)
+        if fault:
+            sim._count(fault)
+
+        if fault == 'timeout':
+            time.sleep(sim._settings['hang'])
+            self.close_connection = True
+            return
+        if fault == 'error':
+            code = rnd.choice((500, 502, 503))
+            return self._send(code, b'<html><body>Server error</body></html>', 'text/html')
+
+        with sim._lock:
+            page, body, etag, lastModified = sim._page, sim._body, sim._etag, sim._lastModified
+        if fault == 'markup':
+            body = rnd.choice(MARKUP_CHANGES)(page).encode('utf-8')
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+
+        headers = dict()
+        if sim._settings['validators']:
+            headers = {'ETag': etag, 'Last-Modified': lastModified}
+            if fault is None and (self.headers.get('If-None-Match') == etag or
+                                  self.headers.get('If-None-Match') is None and self.headers.get('If-Modified-Since') == lastModified):
+                sim._count('notModified')
+                return self._send(304, b'', None, headers)
+
+        if fault is None:
+            sim._count('ok')
+        elif fault == 'truncate':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self._send(200, body, 'text/html; charset=utf-8', headers)
+
+    def do_POST(self):
+        sim = self.server.simulator
+        url = urlsplit(self.path)
+        if url.path != CONTROL_PATH:
+            return self._send(404, b'Not Found', 'text/plain')
+        try:
+            sim.update(**dict(parse_qsl(url.query)))
+        except (KeyError, ValueError) as e:
+            return self._json(400, {'message': 'Invalid setting: %s' % e})
+        self._json(200, sim.status())
+
+    def _json(self, code, obj):
+        self._send(code, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def _send(self, code, body, contentType, headers=dict()):
+        self.send_response(code)
+        if contentType:
+            self.send_header('Content-Type', contentType)
+        for k,v in headers.items():
+            self.send_header(k, v)
+        if code != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# Synthesized page of given months (list of (year, month)). Default: current and next month
+# (Mauritius-local)
+def synthesizedPage(months=None):
+    if not months:
+        sys.path.insert(0, ROOT_DIR)
+        from tidesClock import getClock
+
+        today = getClock().today()
+        months = [(today.year, today.month), (today.year + today.month // 12, today.month % 12 + 1)]
+    from makeFixture import synthesizePage
+    return synthesizePage(months)
+
+
+def parse_argv():
+    parser = argparse.ArgumentParser(description='Local simulator of metservice.intnet.mu, with fault injection')
+    parser.add_argument('-b', '--bind', dest='bind', default='127.0.0.1', help='address to listen on (default=127.0.0.1)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=DEFAULT_PORT, help='port to listen on (default=%d)' % DEFAULT_PORT)
+    parser.add_argument('-f', '--fixture', dest='fixture', default=None, metavar='HTML', help='recorded page to serve')
+    parser.add_argument('-m', '--month', dest='months', action='append', default=None, metavar='MMYYYY',
+                        help='month of the synthesized page (may be repeated. Default: current and next month)')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.0, help='delay in seconds before any response')
+    parser.add_argument('--jitter', dest='jitter', type=float, default=0.0, help='random extra delay in seconds (uniform)')
+    parser.add_argument('--hang', dest='hang', type=float, default=60.0, help='seconds without response on a timeout (default=60)')
+    parser.add_argument('--timeout-rate', dest='timeoutRate', type=float, default=0.0, help='rate of requests not answered')
+    parser.add_argument('--error-rate', dest='errorRate', type=float, default=0.0, help='rate of 5xx responses')
+    parser.add_argument('--truncate-rate', dest='truncateRate', type=float, default=0.0, help='rate of truncated bodies')
+    parser.add_argument('--markup-rate', dest='markupRate', type=float, default=0.0, help='rate of pages with a changed layout')
+    parser.add_argument('--no-validators', dest='validators', action='store_false', default=True,
+                        help='send no ETag / Last-Modified (never 304)')
+    parser.add_argument('--seed', dest='seed', type=int, default=None, help='seed of the random faults')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False, help='log requests')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_argv()
+
+    if args.fixture:
+        with open(args.fixture, 'r') as f:
+            page = f.read()
+    else:
+        page = synthesizedPage([(int(m[2:]), int(m[:2])) for m in args.months or []])
+
+    sim = Simulator(page, {k: getattr(args, k) for k in SETTINGS}, seed=args.seed)
+    url = sim.start(args.bind, args.port, args.verbose)
+    print('Simulating metservice.intnet.mu on %s%s (settings: %s%s)' % (url, PAGE_PATH, url, CONTROL_PATH))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    print(json.dumps(sim.counts))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,12 @@
+import atexit
 import builtins as __builtin__
 from csv import reader
 from datetime import datetime
-import inspect
 import json
+import logging
 import os
+import queue
 import sys
-import requests
 import time
 import unicodedata
 
@@ -32,9 +33,13 @@ def module_path(local_function):
     ''' returns the module path without the use of __file__.  
     Requires a function defined locally in the module.
     from http://stackoverflow.com/questions/729583/getting-file-path-of-imported-module'''
-    return os.path.abspath(inspect.getsourcefile(local_function))
+    return os.path.abspath(local_function.__code__.co_filename)	# No need to import inspect
 
 
+# Queue of messages written to the log file by a background thread (see setLogFile())
+_logQueue    = None
+_logListener = None
+
 def myprint(level, *args, **kwargs):
 
     """My custom print() function."""
@@ -43,8 +48,75 @@ def myprint(level, *args, **kwargs):
     # Instead consider testing if custom argument keywords
     # are present in kwargs
 
-    if level <= config.DEBUG:
-        __builtin__.print('%s%s()%s:' % (color.BOLD, inspect.stack()[1][3], color.END), *args, **kwargs)
+    if level > config.DEBUG:
+        return
+
+    # Name of calling function (no frame records, no source context)
+    caller = sys._getframe(1).f_code.co_name
+
+    if _logQueue is None:
+        __builtin__.print('%s%s()%s:' % (color.BOLD, caller, color.END), *args, **kwargs)
+    else:
+        # Message formatted by caller, written by log thread
+        msg = '%s%s()%s: %s' % (color.BOLD, caller, color.END, kwargs.get('sep', ' ').join(map(str, args)))
+        _logQueue.put_nowait(logging.makeLogRecord({'msg': msg + kwargs.get('end', '\n')}))
+
+
+# Deferred conversion of a debug message argument: func(*args, **kwargs) is only called
+# if the message is actually printed. Example: myprint(2, lazy(json.dumps, data, indent=4))
+class lazy:
+    __slots__ = ('_func', '_args', '_kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self._func   = func
+        self._args   = args
+        self._kwargs = kwargs
+
+    def __str__(self):
+        return str(self._func(*self._args, **self._kwargs))
+
+
+# Write myprint() messages to 'stream' from a background thread
+def setLogFile(stream):
+    global _logQueue, _logListener
+
+    import logging.handlers	# Loaded only when needed
+
+    closeLogFile()
+    handler = logging.StreamHandler(stream)
+    handler.terminator = ''		# Messages are already terminated
+    q = queue.SimpleQueue()
+    _logListener = logging.handlers.QueueListener(q, handler)
+    _logListener.start()
+    _logQueue = q
+    atexit.register(closeLogFile)
+
+
+# Forked process (gunicorn worker): the log thread is not inherited. Start a new one, with a
+# new queue (pending messages of the queue copy are written by the parent)
+def _restartLogListener():
+    global _logQueue, _logListener
+
+    if _logListener:
+        import logging.handlers	# Loaded only when needed
+
+        q = queue.SimpleQueue()
+        _logListener = logging.handlers.QueueListener(q, *_logListener.handlers)
+        _logListener.start()
+        _logQueue = q
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restartLogListener)
+
+
+# Write pending messages and stop the log thread
+def closeLogFile():
+    global _logQueue, _logListener
+
+    if _logListener:
+        _logQueue = None
+        _logListener.stop()
+        _logListener = None
 
 
 # Bubble sort function to sort a list of tuples
@@ -116,6 +188,38 @@ def dumpToFile(fname, plainText):
     return 0
 
 
+####
+# Replace the content of file 'fname' atomically: the text (or bytes) is written to a temporary file
+# of the same directory, flushed to disk, then renamed. Readers see either the previous or
+# the new content, never a partial file.
+def writeFileAtomic(fname, text):
+
+    dirName = os.path.dirname(os.path.abspath(fname))
+    tmpName = os.path.join(dirName, '.%s.%d.tmp' % (os.path.basename(fname), os.getpid()))
+    try:
+        with (open(tmpName, 'wb') if isinstance(text, bytes) else open(tmpName, 'w', encoding='utf-8')) as out:
+            out.write(text)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmpName, fname)
+    except OSError:
+        try:
+            os.unlink(tmpName)
+        except OSError:
+            pass
+        raise
+
+    # Persist the rename itself (directory entry)
+    try:
+        fd = os.open(dirName, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass	# Not supported on all platforms/filesystems
+
+
 ####
 def dumpJsonToFile(fname, textDict):
 
@@ -123,10 +227,8 @@ def dumpJsonToFile(fname, textDict):
     myprint(1,'Dict text length: %d, Plain text length: %d' % (len(textDict), len(str(textDict))))
     #myprint(1,textDict) 
     try:
-        out = open(fname, 'w')
-        out.write(json.dumps(textDict, ensure_ascii=False))
-        out.close()
-    except IOError as e:
+        writeFileAtomic(fname, json.dumps(textDict, ensure_ascii=False))
+    except (IOError, OSError) as e:
         msg = "I/O error: Creating %s: %s" % (fname, "({0}): {1}".format(e.errno, e.strerror))
         myprint(1,msg)
         return -1
@@ -156,8 +258,7 @@ def isFileOlderThanXMinutes(file, minutes=1):
 ####
 def get_linenumber():
 
-    cf = inspect.currentframe()
-    return cf.f_back.f_lineno
+    return sys._getframe(1).f_lineno
 
 
 ####
@@ -8,9 +8,7 @@ class HttpHeaders():
             'Accept': 		'*/*',
             'Accept-Encoding': 	'gzip, deflate, br',
             'Accept-Language': 	'fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7',
-            'Cache-Control': 	'no-cache',
             'Connection': 	'keep-alive',
-            'Pragma': 		'no-cache',
             'User-Agent': 	'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_13_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36'
         }
 
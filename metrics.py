@@ -0,0 +1,173 @@
+# Process metrics (counters, histograms, gauges), exported in Prometheus text format
+#
+# Recording a value takes no lock: each thread updates its own shard (an array of doubles,
+# allocated on first use by the thread) of each series. When a thread exits, its shard is
+# folded into the retired total of the series, so the number of shards is bounded by the
+# number of live threads, also with a thread per request (Flask development server, Werkzeug).
+# Shards are only summed when metrics are collected (render()). Series are created once
+# (get-or-create by name and labels) and kept by the instrumented code.
+#
+# Metrics are per process: with several gunicorn workers, each worker has its own.
+
+from array import array
+from bisect import bisect_left
+import threading
+import time
+import weakref
+
+PREFIX = 'mymetservicetides_'
+
+# Upper bounds (seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Owner of the shard of a thread, only referenced by the thread-local storage: finalized when
+# the thread exits
+class _ShardOwner:
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class _Series:
+    def __init__(self, labels, size):
+        self.labels   = labels		# Prometheus labels: '{k="v",...}' or ''
+        self._size    = size
+        self._local   = threading.local()
+        self._shards  = dict()		# Shards of live threads: id -> shard
+        self._retired = [0.0] * size	# Sum of the shards of exited threads
+        self._lock    = threading.Lock()	# Not taken when recording a value
+
+    def _shard(self):
+        try:
+            return self._local.owner.shard
+        except AttributeError:
+            shard = array('d', bytes(8 * self._size))
+            owner = _ShardOwner(shard)
+            with self._lock:
+                self._shards[id(shard)] = shard
+            weakref.finalize(owner, self._retire, shard)
+            self._local.owner = owner
+            return shard
+
+    # The thread of 'shard' exited
+    def _retire(self, shard):
+        with self._lock:
+            del self._shards[id(shard)]
+            for i in range(self._size):
+                self._retired[i] += shard[i]
+
+    # Sum of all shards
+    def values(self):
+        with self._lock:
+            total = list(self._retired)
+            for shard in self._shards.values():
+                for i in range(self._size):
+                    total[i] += shard[i]
+        return total
+
+
+class Counter(_Series):
+    def __init__(self, labels):
+        super().__init__(labels, 1)
+
+    def inc(self, n=1):
+        self._shard()[0] += n
+
+    def samples(self, name):
+        yield name + '_total', self.labels, self.values()[0]
+
+
+class Histogram(_Series):
+    def __init__(self, labels, buckets):
+        super().__init__(labels, len(buckets) + 2)	# Buckets, +Inf, sum
+        self._buckets = buckets
+
+    def observe(self, v):
+        shard = self._shard()
+        shard[bisect_left(self._buckets, v)] += 1
+        shard[-1] += v
+
+    def samples(self, name):
+        values = self.values()
+        sep = self.labels[:-1] + ',' if self.labels else '{'
+        count = 0
+        for bound, n in zip(self._buckets + ('+Inf',), values):
+            count += n
+            yield name + '_bucket', '%sle="%s"}' % (sep, bound), count
+        yield name + '_sum', self.labels, values[-1]
+        yield name + '_count', self.labels, count
+
+
+class Gauge:
+    def __init__(self, labels, fn):
+        self.labels = labels
+        self._fn    = fn		# Function returning the current value (or None if unknown)
+
+    def samples(self, name):
+        v = self._fn()
+        if v is not None:
+            yield name, self.labels, v
+
+
+####
+# Metric families: name -> [type, help, {labels: series}]
+_families = dict()
+_familiesLock = threading.Lock()
+
+def _labelString(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k,v in sorted(labels.items()))
+
+def _series(kind, name, help, labels, create):
+    key = _labelString(labels)
+    with _familiesLock:
+        family = _families.setdefault(PREFIX + name, [kind, help, dict()])
+        series = family[2].get(key)
+        if series is None:
+            series = family[2][key] = create(key)
+    return series
+
+# Return the counter with given name and labels (created on first call)
+def counter(name, help, **labels):
+    return _series('counter', name, help, labels, Counter)
+
+# Return the histogram with given name and labels (created on first call)
+def histogram(name, help, buckets=LATENCY_BUCKETS, **labels):
+    return _series('histogram', name, help, labels, lambda key: Histogram(key, buckets))
+
+# Register a gauge whose value is returned by fn()
+def gauge(name, help, fn, **labels):
+    return _series('gauge', name, help, labels, lambda key: Gauge(key, fn))
+
+
+# Return all metrics in Prometheus text format (version 0.0.4)
+def render():
+    with _familiesLock:
+        families = [(name, f[0], f[1], list(f[2].values())) for name, f in sorted(_families.items())]
+
+    lines = list()
+    for name, kind, help, series in families:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for s in series:
+            for sampleName, labels, v in s.samples(name):
+                lines.append('%s%s %s' % (sampleName, labels, repr(float(v))))
+    return '\n'.join(lines) + '\n'
+
+
+# Context manager measuring the duration of a block into a histogram
+class timer:
+    __slots__ = ('_histogram', '_t0')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._t0)
+        return False
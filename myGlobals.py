@@ -1,11 +1,19 @@
 # Some glogal constants
 VERSION = '1.0'
 DATA_CACHE_FILE = '.tides.metservice.json'
+DATA_STORE_FILE = '.tides.metservice.db'
+DATA_SNAPSHOT_FILE = '.tides.metservice.snap'
+VALIDATORS_FILE = '.tides.metservice.validators.json'
+REFRESH_STAMP_FILE = '.tides.metservice.refresh'
+DEFAULT_STATION = 'mauritius'
+UPSTREAM_BASE_URL = 'http://metservice.intnet.mu'
 
 # Global variables
 logger = None
 moduleDirPath = ''
 dataCachePath = ''
+dataStorePath = ''
+validatorsPath = ''
 
 # Config parameters
 mandatoryFields = []
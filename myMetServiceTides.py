@@ -2,6 +2,8 @@
 
 # Tool to get tides information from metservice.intnet.mu
 
+import sys
+
 # Import or build our configuration. Must be FIRST
 try:
     import config	# Shared global config variables (DEBUG,...)
@@ -18,18 +20,15 @@ except:
     sys.exit(1)
     
 import argparse
-import builtins as __builtin__
 import datetime
-import inspect
-import json
 import logging
 import os
-import sys
 import time
 
 import myGlobals as mg
-from common.utils import myprint, module_path, get_linenumber, color
+from common.utils import myprint, module_path, get_linenumber, color, setLogFile, closeLogFile
 import tides as mst
+from tidesClock import getClock
 
 # Arguments parser
 def parse_argv():
@@ -70,6 +69,100 @@ def parse_argv():
                         nargs='?',
                         metavar='DELAY',
                         help="update interval in minutes (default=1440, e.g. 24H)")
+    parser.add_argument('-M', '--max-stale',
+                        dest='maxStaleness',
+                        default=10080,
+                        type=int,
+                        action='store',
+                        metavar='MAXSTALE',
+                        help="max age in minutes of outdated cache data served while refreshing (default=10080, e.g. 7 days)")
+    parser.add_argument("-P", "--production",
+                        action="store_true",
+                        dest="production",
+                        default=False,
+                        help="server mode: use a production server instead of the Flask development server")
+    parser.add_argument('-b', '--bind',
+                        dest='bind',
+                        default='127.0.0.1',
+                        action='store',
+                        metavar='ADDRESS',
+                        help="server mode: address to listen on (default=127.0.0.1)")
+    parser.add_argument('-p', '--port',
+                        dest='port',
+                        default=5002,
+                        type=int,
+                        action='store',
+                        metavar='PORT',
+                        help="server mode: port to listen on (default=5002)")
+    parser.add_argument('-u', '--unix-socket',
+                        dest='unixSocket',
+                        default=None,
+                        action='store',
+                        metavar='PATH',
+                        help="production server: listen on unix socket PATH instead of ADDRESS:PORT")
+    parser.add_argument('-w', '--workers',
+                        dest='workers',
+                        default=1,
+                        type=int,
+                        action='store',
+                        metavar='WORKERS',
+                        help="production server: number of worker processes (default=1, requires gunicorn if > 1)")
+    parser.add_argument('-t', '--threads',
+                        dest='threads',
+                        default=8,
+                        type=int,
+                        action='store',
+                        metavar='THREADS',
+                        help="production server: number of threads per worker (default=8)")
+    parser.add_argument('-k', '--keep-alive',
+                        dest='keepAlive',
+                        default=5,
+                        type=int,
+                        action='store',
+                        metavar='SECONDS',
+                        help="production server: idle keep-alive connection timeout (default=5)")
+    parser.add_argument('--legacy-api',
+                        action='store_true',
+                        dest='legacyApi',
+                        default=False,
+                        help="server mode: return tides information as lists of strings (previous API format) unless ?legacy=0 is requested")
+    parser.add_argument('-U', '--upstream',
+                        dest='upstream',
+                        default=None,
+                        action='store',
+                        metavar='URL',
+                        help="base URL of MetService server (default=%s)" % mg.UPSTREAM_BASE_URL)
+    parser.add_argument('--admin-token',
+                        dest='adminToken',
+                        default=None,
+                        action='store',
+                        metavar='TOKEN',
+                        help="server mode: enable the admin endpoint (profiling), for requests with header 'Authorization: Bearer TOKEN' (default: disabled)")
+    parser.add_argument('--cache-dir',
+                        dest='cacheDir',
+                        default=None,
+                        action='store',
+                        metavar='DIR',
+                        help="directory of the local cache file and tides history (default=directory of this module)")
+    parser.add_argument('--parser',
+                        dest='parser',
+                        default='fast',
+                        choices=['fast', 'bs4'],
+                        action='store',
+                        help="engine used to parse the metservice page (default=fast)")
+    parser.add_argument('-S', '--stats',
+                        dest='stats',
+                        const='',
+                        default=None,
+                        action='store',
+                        nargs='?',
+                        metavar='PERIOD',
+                        help="show tides statistics of a month (mmyy) or a year (yyyy). Default: current month")
+    parser.add_argument('--profile-startup',
+                        action='store_true',
+                        dest='profileStartup',
+                        default=False,
+                        help="run the command and report the import time of each module")
     parser.add_argument("-I", "--info",
                         action="store_true", dest="version", default=False,
                         help="print version and exit")
@@ -84,6 +177,49 @@ def parse_argv():
     return args
 
 
+####
+# Number of modules listed by --profile-startup
+PROFILE_STARTUP_TOP = 25
+
+# Run this command again (without --profile-startup) in a new interpreter with import time
+# tracing enabled, and report the time spent importing each module
+def profileStartup():
+    import subprocess	# Loaded only when needed
+
+    argv = [a for a in sys.argv if a != '--profile-startup']
+    cmd = [sys.executable, '-X', 'importtime'] + argv
+    t0 = time.perf_counter()
+    p = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - t0
+
+    # Lines: "import time: self [us] | cumulative | imported package"
+    modules = list()
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:'):
+            sys.stderr.write(line + '\n')	# Output of the command
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            selfUs, cumulUs = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue	# Header line
+        name = fields[2].rstrip()
+        modules.append((selfUs, cumulUs, len(name) - len(name.lstrip()), name.strip()))
+
+    total = sum(m[0] for m in modules)
+    print('\nStartup profile: %s' % ' '.join(argv))
+    print('Command run time: %.1f ms. Imports: %d modules, %.1f ms' % (elapsed * 1000, len(modules), total / 1000))
+    print('%10s %10s  %s' % ('self (ms)', 'cumul (ms)', 'module'))
+    for selfUs, cumulUs, depth, name in sorted(modules, key=lambda m: m[0], reverse=True)[:PROFILE_STARTUP_TOP]:
+        print('%10.2f %10.2f  %s' % (selfUs / 1000, cumulUs / 1000, name))
+
+    # Modules imported directly by this tool (top level of the import tree)
+    print('\nTop-level imports:')
+    for selfUs, cumulUs, depth, name in sorted((m for m in modules if m[2] == 1), key=lambda m: m[1], reverse=True):
+        print('%10.2f  %s' % (cumulUs / 1000, name))
+    return p.returncode
+
+
 ####
 def import_module_by_path(path):
 
@@ -121,6 +257,9 @@ def main():
         print('%s: version %s' % (sys.argv[0], mg.VERSION))
         sys.exit(0)
 
+    if args.profileStartup:
+        sys.exit(profileStartup())
+
     config.SERVER   = args.server
     config.VERBOSE  = args.verbose
     config.NO_CACHE = args.noCache
@@ -148,12 +287,37 @@ def main():
             sys.stderr = sys.stdout            
         except:
             print('Cannot create log file')
+        else:
+            # Debug messages are written to the log file by a background thread
+            setLogFile(sys.stdout)
 
     if args.updateDelay:
         config.UPDATEDELAY = args.updateDelay
     else:
         config.UPDATEDELAY = 1440 # minutes
 
+    # Never serve data older than the update delay plus one failed refresh cycle
+    config.MAX_STALENESS = max(args.maxStaleness, config.UPDATEDELAY)
+
+    config.PARSER = args.parser
+    config.UPSTREAM_URL = args.upstream or getattr(config, 'UPSTREAM_URL', None)
+
+    if args.cacheDir:
+        mg.dataCachePath  = os.path.join(os.path.abspath(args.cacheDir), mg.DATA_CACHE_FILE)
+        mg.dataStorePath  = os.path.join(os.path.abspath(args.cacheDir), mg.DATA_STORE_FILE)
+        mg.validatorsPath = os.path.join(os.path.abspath(args.cacheDir), mg.VALIDATORS_FILE)
+
+    # Server mode parameters
+    config.PRODUCTION  = args.production
+    config.BIND        = args.bind
+    config.PORT        = args.port
+    config.UNIX_SOCKET = args.unixSocket
+    config.WORKERS     = max(1, args.workers)
+    config.THREADS     = max(1, args.threads)
+    config.KEEPALIVE   = max(1, args.keepAlive)
+    config.LEGACY_API  = args.legacyApi
+    config.ADMIN_TOKEN = args.adminToken or getattr(config, 'ADMIN_TOKEN', None)
+
     if config.SERVER:
         import server as msas
         if config.DEBUG:
@@ -167,8 +331,19 @@ def main():
     #
     # Standalone mode
     #
+    if args.stats is not None:
+        period = args.stats or getClock().today().strftime('%m%y')
+        if len(period) != 4 or not period.isdigit():
+            print('Invalid statistics period %s (expected mmyy or yyyy)' % period)
+            sys.exit(1)
+        if 1 <= int(period[:2]) <= 12:	# mmyy (a year 20yy can't be a month)
+            res = mst.showTidesStats(2000 + int(period[2:]), int(period[:2]))
+        else:				# yyyy
+            res = mst.showTidesStats(int(period))
+        sys.exit(1 if res else 0)
+
     if not args.tidesDate:
-        tidesDate = datetime.datetime.now().strftime('%d%m%y')	# Today's tides
+        tidesDate = getClock().todayKey()	# Today's tides (Mauritius-local date)
     else:
         if 'init' in args.tidesDate:
             initConfiguration()
@@ -178,7 +353,7 @@ def main():
         tidesDate = args.tidesDate
         
         if tidesDate == 'tomorrow':
-            dt = datetime.datetime.now() + datetime.timedelta(days=1)
+            dt = getClock().today() + datetime.timedelta(days=1)
             tidesDate = dt.strftime('%d%m%y')
 
         # Check for a valid date
@@ -225,6 +400,7 @@ def main():
         sys.exit(1)
 
     if args.logFile and args.logFile != '':
+        closeLogFile()
         sys.stdout.close()
         sys.stderr.close()
 
@@ -244,6 +420,12 @@ if __name__ == "__main__":
 
     # Absolute pathname of data cache file
     mg.dataCachePath = os.path.join(mg.moduleDirPath, '%s' % (mg.DATA_CACHE_FILE))
+
+    # Absolute pathname of tides history database
+    mg.dataStorePath = os.path.join(mg.moduleDirPath, '%s' % (mg.DATA_STORE_FILE))
+
+    # Absolute pathname of validators of the last page retrieved from MetService server
+    mg.validatorsPath = os.path.join(mg.moduleDirPath, '%s' % (mg.VALIDATORS_FILE))
     
     # Let's go
     main()
@@ -0,0 +1,138 @@
+# On-demand profiling of API requests and cache refreshes (cProfile), without restarting
+#
+# Profiling is armed for the next N requests and/or the next refresh of the cache file, by a
+# signal (SIGUSR1: requests, SIGUSR2: refresh; see installSignalHandlers()) or by the admin
+# endpoint (resources/profiling.py). One profile is collected at a time: a request or refresh
+# starting while another one is profiled is not profiled and doesn't use the armed count.
+# Each profile is saved next to the log file as:
+# - profile-<time>-<pid>-<label>.prof: pstats file (python3 -m pstats FILE, snakeviz,...),
+# - profile-<time>-<pid>-<label>.txt : functions sorted by cumulative time.
+# When nothing is armed, the cost for a request is one integer test.
+
+import contextlib
+import os
+import signal
+import threading
+import time
+
+import myGlobals as mg
+import config
+
+from common.utils import myprint
+
+# Number of requests profiled on SIGUSR1
+PROFILE_REQUESTS = 10
+
+# Max number of requests armed at once
+MAX_PROFILE_REQUESTS = 1000
+
+# Number of functions listed in text reports
+PROFILE_TOP_FUNCTIONS = 40
+
+class Profiler:
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._active   = threading.Lock()	# Held while a profile is collected
+        self._requests = 0		# Number of next requests to profile
+        self._refresh  = False		# Profile next refresh
+
+    def armRequests(self, n=PROFILE_REQUESTS):
+        with self._lock:
+            self._requests = max(0, min(n, MAX_PROFILE_REQUESTS))
+
+    def armRefresh(self, on=True):
+        with self._lock:
+            self._refresh = on
+
+    def status(self):
+        return {'requests': self._requests, 'refresh': self._refresh, 'directory': profileDir()}
+
+    # Start profiling a request (kind='request') or a refresh (kind='refresh') if armed.
+    # Return the profile (to be given to end()), or None
+    def begin(self, kind):
+        if not (self._requests if kind == 'request' else self._refresh):
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        with self._lock:
+            if kind == 'request' and self._requests:
+                self._requests -= 1
+            elif kind == 'refresh' and self._refresh:
+                self._refresh = False
+            else:
+                self._active.release()
+                return None
+
+        import cProfile	# Loaded only when needed
+        prof = cProfile.Profile()
+        prof.t0 = time.perf_counter()
+        prof.enable()
+        return prof
+
+    # Stop a profile started by begin() and save it
+    def end(self, prof, label):
+        prof.disable()
+        elapsed = time.perf_counter() - prof.t0
+        self._active.release()
+        try:
+            saveProfile(prof, label, elapsed)
+        except OSError as e:
+            myprint(0, 'Unable to save profile of %s: %s' % (label, e))
+
+    # Context manager profiling a block if armed for 'kind'
+    @contextlib.contextmanager
+    def profiled(self, kind, label):
+        prof = self.begin(kind)
+        try:
+            yield
+        finally:
+            if prof is not None:
+                self.end(prof, label)
+
+
+# Profiles are written in the directory of the log file (module directory if none)
+def profileDir():
+    if config.LOGFILE:
+        return os.path.dirname(os.path.join(mg.moduleDirPath, config.LOGFILE))
+    return mg.moduleDirPath
+
+def saveProfile(prof, label, elapsed):
+    import io	# Loaded only when needed
+    import pstats
+
+    t = time.time()
+    stamp = '%s.%03d' % (time.strftime('%Y%m%d-%H%M%S', time.localtime(t)), int(t * 1000) % 1000)
+    safeLabel = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in label)
+    base = os.path.join(profileDir(), 'profile-%s-%d-%s' % (stamp, os.getpid(), safeLabel))
+
+    prof.dump_stats(base + '.prof')
+
+    out = io.StringIO()
+    out.write('%s: %.3f ms (wall time), pid %d\n' % (label, elapsed * 1000, os.getpid()))
+    pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    with open(base + '.txt', 'w') as f:
+        f.write(out.getvalue())
+
+    myprint(0, 'Profile of %s (%.1f ms) saved to %s.prof' % (label, elapsed * 1000, base))
+
+
+def _signalHandler(signum, frame):
+    if signum == signal.SIGUSR1:
+        profiler.armRequests(PROFILE_REQUESTS)
+        myprint(0, 'Profiling next %d request(s)' % PROFILE_REQUESTS)
+    else:
+        profiler.armRefresh()
+        myprint(0, 'Profiling next refresh of the cache file')
+
+# SIGUSR1: profile next PROFILE_REQUESTS requests, SIGUSR2: profile next refresh.
+# Must be called from the main thread. Not used with gunicorn (its arbiter and workers
+# handle SIGUSR1 and SIGUSR2 themselves)
+def installSignalHandlers():
+    if not hasattr(signal, 'SIGUSR1'):	# Windows
+        return
+    signal.signal(signal.SIGUSR1, _signalHandler)
+    signal.signal(signal.SIGUSR2, _signalHandler)
+
+
+# Profiler of this process
+profiler = Profiler()
@@ -0,0 +1,117 @@
+# Cache refresh scheduler, running as a thread of the server process
+#
+# The cache is refreshed every update delay, and right after each Mauritius-local midnight
+# (day and month rollover), with some jitter. Next month is also prefetched some hours before
+# the month rollover, so that the cache covers the first days of next month in time. Failed refreshes are retried with an
+# exponential backoff. A refresh can also be requested (e.g. when stale data is served).
+# The time of the next scheduled refresh is published (nextRefreshAt()), for the freshness of
+# responses.
+
+from datetime import datetime, timedelta
+import random
+import threading
+import time
+
+from common.utils import myprint
+from tidesClock import getClock
+
+ROLLOVER_OFFSET = 5 * 60	# Delay (in seconds) after midnight before refreshing
+JITTER          = 2 * 60	# Max random delay (in seconds) added to each scheduled refresh
+RETRY_DELAY     = 60		# Delay (in seconds) before first retry after a failure. Doubled on each failure
+MONTH_PREFETCH  = 6 * 3600	# Delay (in seconds) before the month rollover of the prefetch of next month
+
+_running = None		# Scheduler running in this process (not in forked gunicorn workers)
+
+# Return the scheduler running in this process, or None
+def runningScheduler():
+    s = _running
+    return s if s is not None and s.is_alive() else None
+
+# Return the time (seconds since epoch) of the next scheduled refresh of the cache file: the
+# one published by the scheduler running in this process or, without it (gunicorn workers,
+# command line), the schedule without jitter from the time of the last refresh
+def nextRefreshAt(lastRefresh, updateDelay):
+    s = runningScheduler()
+    if s is not None and s.nextRefreshAt is not None:
+        return s.nextRefreshAt
+
+    clock = getClock()
+    at = min(lastRefresh + updateDelay * 60, clock.nextRollover() + ROLLOVER_OFFSET)
+    prefetch = clock.nextMonthRollover() - MONTH_PREFETCH
+    if prefetch > clock.now():
+        at = min(at, prefetch)
+    return at
+
+
+class RefreshScheduler(threading.Thread):
+    def __init__(self, refresh, updateDelay):
+        super().__init__(name='refreshScheduler', daemon=True)
+        self._refresh     = refresh		# Function refreshing the cache. Returns 0 on success
+        self._updateDelay = updateDelay * 60	# seconds
+        self._failures    = 0
+        self._stopped     = threading.Event()
+        self._wakeup      = threading.Event()
+        self.nextRefreshAt = None		# Time (seconds since epoch) of next scheduled refresh
+
+    # Request an immediate refresh. Ignored while retrying after a failure (backoff)
+    def trigger(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    # Delay (in seconds) before next refresh
+    def nextDelay(self):
+        if self._failures:
+            backoff = min(RETRY_DELAY * 2 ** (self._failures - 1), self._updateDelay)
+            return backoff / 2 + random.uniform(0, backoff / 2)
+
+        clock = getClock()
+        now = clock.now()
+        delay = min(self._updateDelay, clock.nextRollover() - now + ROLLOVER_OFFSET)
+        toPrefetch = clock.nextMonthRollover() - MONTH_PREFETCH - now
+        if toPrefetch > 0:
+            delay = min(delay, toPrefetch)
+        return delay + random.uniform(0, JITTER)
+
+    def run(self):
+        global _running
+        _running = self
+        myprint(1, 'Started. Updating cache every %d minutes (%s) and after each Mauritius-local midnight' % (self._updateDelay // 60, str(timedelta(seconds=self._updateDelay))))
+
+        while not self._stopped.is_set():
+            delay = self.nextDelay()
+            self.nextRefreshAt = getClock().now() + delay
+            myprint(1, 'Next refresh in %d seconds (%s)' % (delay, str(timedelta(seconds=int(delay)))))
+
+            deadline = time.monotonic() + delay
+            while not self._stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self._wakeup.wait(remaining):
+                    self._wakeup.clear()
+                    if not self._failures and not self._stopped.is_set():
+                        myprint(1, 'Refresh requested')
+                        break
+            if self._stopped.is_set():
+                break
+
+            dt_now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            myprint(0, 'Reloading cache file from server at %s...' % (dt_now))
+            try:
+                res = self._refresh()
+            except Exception as e:
+                myprint(0, 'Exception while refreshing cache: %s' % e)
+                res = -1
+            if res:
+                self._failures += 1
+                myprint(0, 'Failed to create/update local data cache (%d consecutive failure(s))' % self._failures)
+            else:
+                self._failures = 0
+                myprint(0, 'Data collected from server at %s' % (dt_now))
+
+        myprint(1, 'Stopped')
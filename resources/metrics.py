@@ -0,0 +1,49 @@
+from flask import request, Response
+from flask_restful import Resource
+import time
+
+import metrics
+
+# Key of the request start time in the WSGI environment
+START_KEY = 'mymetservicetides.start'
+
+# Status classes of HTTP responses
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+
+# Endpoint -> (latency histogram, (counter per status class))
+_endpoints = dict()
+
+def _endpointSeries(endpoint):
+    return (metrics.histogram('http_request_duration_seconds', 'Time to build the response of API requests', endpoint=endpoint),
+            tuple(metrics.counter('http_requests', 'API requests', endpoint=endpoint, status=c) for c in STATUS_CLASSES))
+
+
+def _beforeRequest():
+    request.environ[START_KEY] = time.perf_counter()
+
+def _afterRequest(response):
+    t0 = request.environ.get(START_KEY)
+    if t0 is not None:
+        series = _endpoints.get(request.endpoint) or _endpoints[None]
+        series[0].observe(time.perf_counter() - t0)
+        series[1][min(response.status_code // 100, 5) - 1].inc()
+    return response
+
+
+# Measure latency and count responses of all endpoints of 'app' (must be called after all
+# resources have been added)
+def instrumentApp(app):
+    for endpoint in [e for e in app.view_functions if e != 'static'] + [None]:
+        _endpoints[endpoint] = _endpointSeries(endpoint or 'unmatched')
+    app.before_request(_beforeRequest)
+    app.after_request(_afterRequest)
+
+
+class MetricsAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /metrics (Prometheus text format)
+    def get(self):
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
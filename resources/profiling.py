@@ -0,0 +1,74 @@
+import hmac
+
+from flask import request
+from flask_restful import Resource, abort
+
+import config
+from profiling import profiler, MAX_PROFILE_REQUESTS
+from refreshScheduler import runningScheduler
+
+# Key of the request profile in the WSGI environment
+PROFILE_KEY = 'mymetservicetides.profile'
+
+
+# Token of the admin endpoint (--admin-token, or ADMIN_TOKEN in config.py). None: endpoint disabled
+def adminToken():
+    return getattr(config, 'ADMIN_TOKEN', None) or None
+
+
+def _beforeRequest():
+    if request.endpoint == 'profile':	# Don't use the armed count on the admin endpoint
+        return
+    prof = profiler.begin('request')
+    if prof is not None:
+        request.environ[PROFILE_KEY] = prof
+
+def _teardownRequest(exc):
+    prof = request.environ.pop(PROFILE_KEY, None)
+    if prof is not None:
+        profiler.end(prof, 'request-%s' % (request.endpoint or 'unmatched'))
+
+
+# Profile armed requests of all endpoints of 'app' (see profiling.py)
+def profileApp(app):
+    app.before_request(_beforeRequest)
+    app.teardown_request(_teardownRequest)
+
+
+class ProfileAPI(Resource):
+
+    # The remote address is not checked: behind a reverse proxy (or on a unix socket) it
+    # doesn't tell a local client. Requests must carry the admin token
+    def __init__(self):
+        token = adminToken()
+        if token is None:
+            abort(404, message='Admin endpoint disabled (see --admin-token)')
+        auth = request.headers.get('Authorization', '')
+        if not (auth.startswith('Bearer ') and hmac.compare_digest(auth[7:].strip().encode('utf-8'), token.encode('utf-8'))):
+            abort(403, message='Invalid admin token')
+
+    # GET /mymetservicetides/admin/profile: what is armed
+    def get(self):
+        return profiler.status()
+
+    # POST /mymetservicetides/admin/profile?requests=N&refresh=1: profile next N requests
+    # and/or next refresh of the cache file
+    def post(self):
+        n = request.args.get('requests')
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes', 'on')
+        if n is None and not refresh:
+            abort(400, message='Expecting requests=N and/or refresh=1')
+        # Refreshes are run by the scheduler of the main process (not by gunicorn workers)
+        if refresh and runningScheduler() is None:
+            abort(409, message='Cache refreshes are not run by this process (gunicorn worker): refresh profiling is not available')
+        if n is not None:
+            try:
+                n = int(n)
+                if not 0 <= n <= MAX_PROFILE_REQUESTS:
+                    raise ValueError
+            except ValueError:
+                abort(400, message='Invalid number of requests (0..%d)' % MAX_PROFILE_REQUESTS)
+            profiler.armRequests(n)
+        if refresh:
+            profiler.armRefresh()
+        return profiler.status()
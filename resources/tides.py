@@ -1,14 +1,91 @@
 from datetime import datetime
-from flask import jsonify, make_response # redirect, request, url_for, current_app, flash, 
-from flask_restful import Resource
+from flask import jsonify, make_response, request, Response, stream_with_context # redirect, url_for, current_app, flash, 
+from flask_restful import Resource, abort
+from flask_restful.representations.json import output_json
 from flask_httpauth import HTTPBasicAuth
 import json
+import re
+import time
 
 import config
 import authinfo
 import tides as mst
+from tidesRecord import dateKeyToOrdinal
+from tidesTimeline import eventToDict
+from tidesClock import getClock
 import myGlobals as mg
-from common.utils import myprint, masked
+from common.utils import myprint, masked, lazy
+from refreshScheduler import nextRefreshAt
+
+# Header added to responses built from outdated data (served while the cache is refreshed)
+STALE_HEADERS = {'Warning': '110 - "Response is Stale"'}
+
+# Max number of events returned by /tides/next
+MAX_NEXT_TIDES = 100
+
+# Max number of dates in a /tides/batch request
+MAX_BATCH_IDS = 366
+
+# Limits of the step of /tides/curve (seconds)
+MIN_CURVE_STEP = 60
+MAX_CURVE_STEP = 6 * 3600
+
+# Step of /tides/curve: number followed by unit (s, m or h). Default unit is minute
+STEP_RE = re.compile(r'^(\d+)([smh]?)$')
+STEP_UNITS = {'s': 1, 'm': 60, '': 60, 'h': 3600}
+
+# Output format of tides information: typed dict (see TideDay.toDict()), or legacy list of
+# strings if requested with ?legacy=1 (default set by server option --legacy-api)
+def legacyRequested():
+    v = request.args.get('legacy')
+    if v is None:
+        return getattr(config, 'LEGACY_API', False)
+    return v.lower() in ('1', 'true', 'yes')
+
+def tidesToJson(info, legacy):
+    if info is None:
+        return None
+    return info.toList() if legacy else info.toDict()
+
+
+# Build a JSON response, as flask_restful would do for a Resource returning 'info'
+def jsonResponse(info, headers=None):
+    resp = output_json(info, 200, headers)
+    resp.mimetype = 'application/json'
+    return resp
+
+
+# Build a response with cache validators (ETag, Last-Modified) and freshness information
+# (Cache-Control) derived from the cache file. Conditional requests get a 304.
+# 'tag' identifies the resource in the table, 'expires' is an optional time (seconds since epoch)
+# after which the response becomes invalid, whatever the cache content. 'since' is the time from
+# which a date-relative resource (today, current month) designates its current content: it is
+# the Last-Modified time if later than the cache file, so that a client revalidating with
+# If-Modified-Since only doesn't keep the content of the previous day or month.
+def conditionalResponse(info, tag, expires=None, since=None):
+    cache = mst.cache
+    if info is None or cache.version is None:
+        return jsonResponse(info)
+
+    if cache.stale:
+        maxAge = 0
+        headers = STALE_HEADERS
+    else:
+        # Fresh until next scheduled refresh of the cache file
+        now = time.time()
+        nextRefresh = nextRefreshAt(cache.mtime, config.UPDATEDELAY)
+        if expires:
+            nextRefresh = min(nextRefresh, expires)
+        maxAge = max(0, int(nextRefresh - now))
+        headers = None
+
+    resp = jsonResponse(info, headers)
+    resp.set_etag('%s-%s' % (cache.version, tag))
+    resp.last_modified = int(max(cache.mtime, since or 0))
+    resp.cache_control.public  = True
+    resp.cache_control.max_age = maxAge
+    return resp.make_conditional(request)
+
 
 def unauthorized():
     # return 403 instead of 401 to prevent browsers from displaying the default
@@ -22,9 +99,10 @@ class TidesAPI(Resource):
         pass
     
     def get(self, id):
-        info = mst.getTidesInfo(id)
-        myprint(1, json.dumps(info, ensure_ascii=False))
-        return info
+        legacy = legacyRequested()
+        info = tidesToJson(mst.getTidesInfo(id), legacy)
+        myprint(1, lazy(json.dumps, info, ensure_ascii=False))
+        return conditionalResponse(info, id + '-l' if legacy else id)
 
     def put(self, id):
         pass
@@ -39,9 +117,14 @@ class TodayTidesAPI(Resource):
         pass
     
     def get(self):
-        info = mst.getTidesInfo(datetime.now().strftime('%d%m%y'))
-        myprint(1, json.dumps(info, ensure_ascii=False))
-        return info
+        clock = getClock()	# Mauritius-local "today", whatever the time zone of the server
+        today = clock.todayKey()
+        legacy = legacyRequested()
+        info = tidesToJson(mst.getTidesInfo(today), legacy)
+        myprint(1, lazy(json.dumps, info, ensure_ascii=False))
+        # Response changes at midnight
+        return conditionalResponse(info, today + '-l' if legacy else today,
+                                   expires=clock.nextRollover(), since=clock.midnight(clock.today()))
 
     def put(self, id):
         pass
@@ -49,3 +132,199 @@ class TodayTidesAPI(Resource):
     def delete(self, id):
         pass
     
+
+
+class TidesRangeAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /tides/range?from=ddmmyy&to=ddmmyy[&format=json|ndjson][&legacy=1]
+    # Rows are streamed as they are read from the tides history
+    def get(self):
+        fromDate = request.args.get('from', '')
+        toDate   = request.args.get('to', fromDate)
+        fmt      = request.args.get('format', 'json')
+        legacy   = legacyRequested()
+
+        try:
+            if dateKeyToOrdinal(fromDate) > dateKeyToOrdinal(toDate):
+                abort(400, message='Invalid date range: %s > %s' % (fromDate, toDate))
+        except ValueError as e:
+            abort(400, message=str(e))
+        if fmt not in ('json', 'ndjson'):
+            abort(400, message='Invalid format: %s' % fmt)
+
+        myprint(1, 'Tides from %s to %s (%s)' % (fromDate, toDate, fmt))
+        rows = mst.getTidesRange(fromDate, toDate)
+
+        if fmt == 'ndjson':
+            def generate():
+                for k,info in rows:
+                    yield json.dumps({'date': k, 'tides': tidesToJson(info, legacy)}, ensure_ascii=False) + '\n'
+            mimetype = 'application/x-ndjson'
+        else:
+            def generate():
+                sep = '['
+                for k,info in rows:
+                    yield sep + json.dumps({'date': k, 'tides': tidesToJson(info, legacy)}, ensure_ascii=False)
+                    sep = ','
+                yield '[]' if sep == '[' else ']'
+            mimetype = 'application/json'
+
+        headers = STALE_HEADERS if mst.cache.stale else None
+        return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+
+class NextTidesAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /tides/next[?type=high|low][&n=K]
+    def get(self):
+        kind = request.args.get('type')
+        if kind not in (None, 'high', 'low'):
+            abort(400, message='Invalid tide type: %s' % kind)
+        try:
+            n = int(request.args.get('n', 1))
+        except ValueError:
+            n = 0
+        if n < 1 or n > MAX_NEXT_TIDES:
+            abort(400, message='Invalid number of tides (1..%d)' % MAX_NEXT_TIDES)
+
+        events = mst.getNextTides(kind, n)
+        info = [eventToDict(e) for e in events] if events is not None else None
+        myprint(1, lazy(json.dumps, info, ensure_ascii=False))
+        if mst.cache.stale:
+            return info, 200, STALE_HEADERS
+        return info
+
+
+# Convert the 'at' parameter (seconds since epoch, or ISO 8601 time, Mauritius-local if no
+# time zone given) to a timestamp. Raise ValueError if invalid
+def parseInstant(at):
+    try:
+        ts = float(at)
+    except ValueError:
+        dt = datetime.fromisoformat(at)
+        if dt.tzinfo is None:
+            dt = getClock().localize(dt)
+        ts = dt.timestamp()
+    # Out of the range of dates (nan, inf, 1e20,...)
+    try:
+        getClock().fromTimestamp(ts)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError('time out of range: %s' % at)
+    return ts
+
+
+class WaterHeightAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /tides/height[?at=time] (default: now)
+    def get(self):
+        at = request.args.get('at')
+        try:
+            ts = parseInstant(at) if at else getClock().now()
+        except (ValueError, OverflowError, OSError):
+            abort(400, message='Invalid time: %s (expected seconds since epoch or ISO 8601)' % at)
+
+        height, rising = mst.getWaterHeight(ts)
+        info = {
+            'time'   : getClock().fromTimestamp(ts).isoformat(),
+            'height' : round(height, 1) if height is not None else None,
+            'rising' : rising,
+        }
+        myprint(1, lazy(json.dumps, info))
+        if mst.cache.stale:
+            return info, 200, STALE_HEADERS
+        return info
+
+
+class TidesCurveAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /tides/curve?date=ddmmyy[&step=5m]
+    # Water heights of the day, from Mauritius-local midnight, every step
+    def get(self):
+        tidesDate = request.args.get('date', '')
+        try:
+            dateKeyToOrdinal(tidesDate)
+        except ValueError as e:
+            abort(400, message=str(e))
+        m = STEP_RE.match(request.args.get('step', '5m'))
+        step = int(m.group(1)) * STEP_UNITS[m.group(2)] if m else 0
+        if not MIN_CURVE_STEP <= step <= MAX_CURVE_STEP:
+            abort(400, message='Invalid step (%ds..%dh)' % (MIN_CURVE_STEP, MAX_CURVE_STEP // 3600))
+
+        heights = mst.getTidesCurve(tidesDate, step)
+        info = {'date': tidesDate, 'step': step, 'heights': heights} if heights is not None else None
+        return conditionalResponse(info, 'curve-%s-%d' % (tidesDate, step))
+
+
+# Convert a month (mmyy) to (year, month). Raise ValueError if invalid
+def parseMonth(mmyy):
+    if len(mmyy) != 4 or not mmyy.isdigit() or not 1 <= int(mmyy[:2]) <= 12:
+        raise ValueError('Invalid month: %s (expected mmyy)' % mmyy)
+    return 2000 + int(mmyy[2:]), int(mmyy[:2])
+
+
+class TidesStatsAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # GET /tides/stats[?month=mmyy | ?year=yyyy] (default: current month)
+    def get(self):
+        yyyy = request.args.get('year')
+        mmyy = request.args.get('month')
+        expires = since = None
+        try:
+            if yyyy is not None:
+                if len(yyyy) != 4 or not yyyy.isdigit():
+                    raise ValueError('Invalid year: %s (expected yyyy)' % yyyy)
+                year, month = int(yyyy), None
+            elif mmyy:
+                year, month = parseMonth(mmyy)
+            else:			# Current month: response changes at month rollover
+                clock = getClock()
+                today = clock.today()
+                year, month = today.year, today.month
+                expires, since = clock.nextMonthRollover(), clock.midnight(today.replace(day=1))
+        except ValueError as e:
+            abort(400, message=str(e))
+
+        info = mst.getTidesStats(year, month)
+        tag = 'stats-%d' % year if month is None else 'stats-%02d%02d' % (month, year % 100)
+        return conditionalResponse(info, tag, expires=expires, since=since)
+
+
+class TidesBatchAPI(Resource):
+
+    def __init__(self):
+        pass
+
+    # POST /tides/batch[?legacy=1] with a JSON list of dates (ddmmyy), or {"ids": [...]}
+    # Errors are reported per date: [{"id": ..., "tides": {...}}, {"id": ..., "error": "..."}, ...]
+    def post(self):
+        body = request.get_json(silent=True)
+        ids = body.get('ids') if isinstance(body, dict) else body
+        if not isinstance(ids, list) or not all(isinstance(k, str) for k in ids):
+            abort(400, message='Expecting a JSON list of dates (ddmmyy)')
+        if len(ids) > MAX_BATCH_IDS:
+            abort(400, message='Too many dates (max %d)' % MAX_BATCH_IDS)
+
+        legacy = legacyRequested()
+        info = mst.getTidesInfoBatch(ids)
+        for d in info:
+            if 'tides' in d:
+                d['tides'] = tidesToJson(d['tides'], legacy)
+        myprint(1, '%d dates requested' % len(ids))
+        if mst.cache.stale:
+            return info, 200, STALE_HEADERS
+        return info
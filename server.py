@@ -4,61 +4,46 @@ import datetime
 from dateutil.relativedelta import relativedelta
 from flask import Flask
 from flask_restful import Api, Resource
-import inspect
 import json
-from multiprocessing import Process, Value
 import os
+import signal
 import sys
 import time
 
 import config
 from common.utils import myprint, isFileOlderThanXMinutes
-import myMetServiceTides as mst
+import tides as mst
+import profiling
+from refreshScheduler import RefreshScheduler
 
-from resources.tides import TidesAPI, TodayTidesAPI
+from resources.metrics import MetricsAPI, instrumentApp
+from resources.profiling import ProfileAPI, profileApp, adminToken
+from resources.tides import TidesAPI, TodayTidesAPI, TidesRangeAPI, NextTidesAPI, TidesBatchAPI, WaterHeightAPI, TidesCurveAPI, TidesStatsAPI
 
 DATACACHE_AGING_IN_MINUTES = 24 * 60
 
+# Max delay (in seconds) given to workers to complete pending requests on shutdown
+GRACEFUL_TIMEOUT = 30
+
 apiResources = {
     "tides" : [
         (TidesAPI, '/mymetservicetides/api/v1.0/tides/<string:id>', 'tides'),
-        (TodayTidesAPI, '/mymetservicetides/api/v1.0/tides', 'todaytides')
+        (TodayTidesAPI, '/mymetservicetides/api/v1.0/tides', 'todaytides'),
+        (TidesRangeAPI, '/mymetservicetides/api/v1.0/tides/range', 'tidesrange'),
+        (NextTidesAPI, '/mymetservicetides/api/v1.0/tides/next', 'nexttides'),
+        (TidesBatchAPI, '/mymetservicetides/api/v1.0/tides/batch', 'tidesbatch'),
+        (WaterHeightAPI, '/mymetservicetides/api/v1.0/tides/height', 'waterheight'),
+        (TidesCurveAPI, '/mymetservicetides/api/v1.0/tides/curve', 'tidescurve'),
+        (TidesStatsAPI, '/mymetservicetides/api/v1.0/tides/stats', 'tidesstats')
+    ],
+    "metrics" : [
+        (MetricsAPI, '/metrics', 'metrics')
+    ],
+    "admin" : [
+        (ProfileAPI, '/mymetservicetides/admin/profile', 'profile')
     ],
 }
 
-def foreverLoop(loop_on, dataCachePath, debug, updateDelay):
-    config.DEBUG = debug
-
-    class color:
-        BOLD      = '\033[1m'
-        UNDERLINE = '\033[4m'
-        END       = '\033[0m'
-
-    # Re-define myprint() as child process don't share globals :(
-    def myprint(level, *args, **kwargs):
-        import builtins as __builtin__
-        
-        if level <= config.DEBUG:
-            __builtin__.print('%s%s()%s:' % (color.BOLD, inspect.stack()[1][3], color.END), *args, **kwargs)
-
-    myprint(1,'Started. Updating cache file every %d minutes (%s).' % (updateDelay, str(datetime.timedelta(minutes=updateDelay))))
-    
-    myprint(1,'Cache file: %s' % dataCachePath)
-
-    updateDelayInSecs = updateDelay * 60
-    
-    while True:
-        if loop_on.value == True:
-            time.sleep(updateDelayInSecs)
-            dt_now = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-            myprint(0, 'Reloading cache file from server at %s...' % (dt_now))
-            res = mst.getTidesInfoFromMetServiceServer()
-            if res:
-                myprint(0, 'Failed to create/update local data cache')
-            else:
-                myprint(0, 'Data collected from server at %s' % (dt_now))            
-
-
 def apiServerMain():
 
     dt_now = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
@@ -69,25 +54,35 @@ def apiServerMain():
     api = Api(app)
 
     for resourceName, resourceParamList in apiResources.items():
+        if resourceName == 'admin' and adminToken() is None:
+            myprint(1, 'Admin endpoint disabled (no admin token)')
+            continue
         for resource in resourceParamList:
             resApi = resource[0]
             resUrl = resource[1]
             resEndpoint = resource[2]
             myprint(1, 'Adding Resource:', resourceName, resApi, resUrl, resEndpoint)
             api.add_resource(resApi, resUrl, endpoint=resEndpoint)
+
+    # Latency and status of responses of all endpoints (see /metrics)
+    instrumentApp(app)
+
+    # On-demand profiling of requests and refreshes (admin endpoint, SIGUSR1/SIGUSR2)
+    profileApp(app)
+    if not (config.PRODUCTION and config.WORKERS > 1):
+        profiling.installSignalHandlers()
             
     # Check if local cache file exists.
     # In this case, check its modification time and reload it from MetService server if too old.
+    # Outdated data is kept (and served as stale) if the server can't be reached.
     if os.path.isfile(mg.dataCachePath):
         if isFileOlderThanXMinutes(mg.dataCachePath, minutes=DATACACHE_AGING_IN_MINUTES):
             t = os.path.getmtime(mg.dataCachePath)
             dt = datetime.datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M:%S')
-            myprint(0, 'Cache file outdated (%s). Deleting and reloading from MetService server' % dt)
-            # Remove data cache file and reload from server
-            os.remove(mg.dataCachePath)
+            myprint(0, 'Cache file outdated (%s). Reloading from MetService server' % dt)
             res = mst.getTidesInfoFromMetServiceServer()
-            if res:
-                myprint(0, 'Failed to create local data cache. Aborting server')
+            if res and isFileOlderThanXMinutes(mg.dataCachePath, minutes=config.MAX_STALENESS):
+                myprint(0, 'Failed to update local data cache. Aborting server')
                 return res
     else:
         res = mst.getTidesInfoFromMetServiceServer()
@@ -95,13 +90,158 @@ def apiServerMain():
             myprint(0, 'Failed to create local data cache. Aborting server')
             return res
         
-    recording_on = Value('b', True)
-    p = Process(target=foreverLoop, args=(recording_on,
-                                          mg.dataCachePath,
-                                          config.DEBUG,
-                                          config.UPDATEDELAY))
-    p.start()  
-    app.run(debug=True, use_reloader=False, port=5002) ##, host="0.0.0.0", port=6420)
-    p.join()
+    # Binary snapshot shared by all workers (missing if the cache file was written by a previous version)
+    mst.ensureSnapshot()
+
+    # Cache refresher: thread of this process, publishing new data straight into the in-process cache
+    scheduler = RefreshScheduler(mst.getTidesInfoFromMetServiceServer, config.UPDATEDELAY)
+    mst.cache.setRefresher(scheduler.trigger)	# Stale data: request a refresh from the scheduler
+    scheduler.start()
+    mainPid = os.getpid()
+    try:
+        if config.PRODUCTION:
+            res = productionServer(app)
+        else:
+            app.run(debug=True, use_reloader=False, port=config.PORT) ##, host="0.0.0.0", port=6420)
+            res = 0
+    finally:
+        # Stop the cache refresher (not in forked workers)
+        if os.getpid() == mainPid:
+            scheduler.stop(timeout=GRACEFUL_TIMEOUT)
+
+    return res
+
+
+####
+# Production mode: multi-threaded (waitress) or pre-fork (gunicorn, if more than one worker)
+# server. The cache refresher is started once, by the main process, before serving.
+# gunicorn workers don't inherit the refresher thread: they reload the cache file when modified.
+def productionServer(app):
 
+    if config.UNIX_SOCKET:
+        listen = 'unix:%s' % config.UNIX_SOCKET
+    else:
+        listen = '%s:%d' % (config.BIND, config.PORT)
+
+    myprint(0, 'Production server listening on %s (%d worker(s), %d thread(s) each)' % (listen, config.WORKERS, config.THREADS))
+    mg.logger.info('Production server listening on %s' % listen)
+
+    if config.WORKERS > 1:
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            myprint(0, 'gunicorn is required to run more than one worker (pip install gunicorn)')
+            return 1
+
+        class GunicornServer(BaseApplication):
+            def __init__(self, app, options):
+                self._app = app
+                self._options = options
+                super().__init__()
+
+            def load_config(self):
+                for k,v in self._options.items():
+                    self.cfg.set(k, v)
+
+            def load(self):
+                return self._app
+
+        options = {
+            'bind'             : listen,
+            'workers'          : config.WORKERS,
+            'threads'          : config.THREADS,
+            'worker_class'     : 'gthread',
+            'keepalive'        : config.KEEPALIVE,
+            'graceful_timeout' : GRACEFUL_TIMEOUT,
+            'preload_app'      : True,	# Application loaded once by the master process, then forked
+        }
+        try:
+            GunicornServer(app, options).run()
+        except SystemExit as e:		# Raised by the arbiter on shutdown
+            return e.code or 0
+        return 0
+
+    try:
+        import waitress	# Loaded only when needed
+    except ImportError:
+        # Fallback to Werkzeug multi-threaded server (debugger off)
+        myprint(0, 'waitress not found (pip install waitress). Using Werkzeug threaded server')
+        host = 'unix://%s' % config.UNIX_SOCKET if config.UNIX_SOCKET else config.BIND
+        app.run(host=host, port=config.PORT, debug=False, use_reloader=False, threaded=True)
+        return 0
+
+    # SIGTERM (systemd stop): drain the server before exiting (see _runWaitress())
+    signal.signal(signal.SIGTERM, _sigtermHandler)
+
+    kwargs = {
+        'threads'         : config.THREADS,
+        'channel_timeout' : config.KEEPALIVE,	# Idle keep-alive connections are closed after this delay
+        'cleanup_interval': max(1, config.KEEPALIVE // 2),
+        'ident'           : 'myMetServiceTides',
+    }
+    if config.UNIX_SOCKET:
+        kwargs['unix_socket'] = config.UNIX_SOCKET
+        kwargs['unix_socket_perms'] = '660'	# Owner and group of the server only (e.g. reverse proxy in the group)
+    else:
+        kwargs['host'] = config.BIND
+        kwargs['port'] = config.PORT
+    _runWaitress(app, kwargs)
     return 0
+
+
+# Set by SIGTERM: the waitress server is drained, then exits
+stopRequested = False
+_wakeup = None		# Function waking up the main loop of the waitress server
+
+def _sigtermHandler(signum, frame):
+    global stopRequested
+    myprint(0, 'Received signal %d. Completing pending requests (at most %d seconds)' % (signum, GRACEFUL_TIMEOUT))
+    stopRequested = True
+    if _wakeup:
+        _wakeup()
+
+
+# Serve with waitress until SIGTERM, then drain: the listening sockets are closed (new
+# connections are refused), idle keep-alive connections are closed, and requests being
+# received or processed are completed, for at most GRACEFUL_TIMEOUT seconds. The main loop
+# of waitress is run here, as serve() cancels queued requests on exit and gives 5 seconds to
+# those being processed. Uses internals of waitress (wasyncore, HTTPChannel.requests and
+# total_outbufs_len, task_dispatcher): tested with waitress 3.0.2 (see README).
+def _runWaitress(app, kwargs):
+    global _wakeup
+    from waitress import wasyncore
+    from waitress.channel import HTTPChannel
+    from waitress.server import create_server, BaseWSGIServer
+
+    sockets = dict()		# Listening sockets, connections and trigger of the server
+    server = create_server(app, map=sockets, **kwargs)
+    adj = server.adj
+    _wakeup = next(d for d in sockets.values() if isinstance(d, BaseWSGIServer)).pull_trigger
+    deadline = None
+    try:
+        while sockets:
+            wasyncore.loop(timeout=adj.asyncore_loop_timeout, map=sockets, use_poll=adj.asyncore_use_poll, count=1)
+            if not stopRequested:
+                continue
+
+            if deadline is None:
+                deadline = time.monotonic() + GRACEFUL_TIMEOUT
+                for d in list(sockets.values()):
+                    if isinstance(d, BaseWSGIServer):
+                        wasyncore.dispatcher.close(d)	# Listening socket only: the trigger is used by pending requests
+
+            connections = [c for c in list(sockets.values()) if isinstance(c, HTTPChannel)]
+            if not connections:
+                break
+            if time.monotonic() >= deadline:
+                myprint(0, '%d connection(s) still busy after %d seconds. Closing' % (len(connections), GRACEFUL_TIMEOUT))
+                break
+            for c in connections:
+                if not c.requests and not c.total_outbufs_len:
+                    c.will_close = True		# Idle: closed by the next loop
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.task_dispatcher.shutdown(cancel_pending=True, timeout=1)
+        wasyncore.close_all(sockets)
+    myprint(0, 'Server stopped')
@@ -0,0 +1,50 @@
+# Tests of metrics.py: shards of exited threads are retired into the totals of the series
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+THREADS = 200
+
+class ShardRetirementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.counter   = metrics.counter('test_requests', 'Test requests', test=self.id())
+        self.histogram = metrics.histogram('test_request_duration_seconds', 'Test request duration', test=self.id())
+
+    def _request(self):
+        self.counter.inc()
+        self.histogram.observe(0.001)
+
+    # A server starting a thread per request (Werkzeug): shards don't accumulate
+    def test_thread_per_request(self):
+        for i in range(THREADS):
+            t = threading.Thread(target=self._request)
+            t.start()
+            t.join()
+
+        self.assertLessEqual(len(self.counter._shards), threading.active_count())
+        self.assertLessEqual(len(self.histogram._shards), threading.active_count())
+        self.assertEqual(self.counter.values(), [THREADS])
+        values = self.histogram.values()
+        self.assertEqual(sum(values[:-1]), THREADS)
+        self.assertAlmostEqual(values[-1], THREADS * 0.001)
+
+    # Values recorded by live and exited threads are both counted
+    def test_live_and_exited_threads(self):
+        t = threading.Thread(target=self._request)
+        t.start()
+        t.join()
+        self._request()
+
+        self.assertEqual(len(self.counter._shards), 1)
+        self.assertEqual(self.counter.values(), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
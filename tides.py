@@ -1,19 +1,29 @@
-from bs4 import BeautifulSoup
 from datetime import datetime, date
+import itertools
 import json
 import os
-import pytz
-import requests
+import re
 import time
 import shutil
 import sys
+import threading
 import unicodedata
 
 import myGlobals as mg
 import httpHeaders as hh
 import config
 
-from common.utils import myprint, color, dumpToFile, dumpJsonToFile, dumpListToFile, dumpListOfListToFile, bubbleSort, isFileOlderThanXMinutes
+import metrics
+from profiling import profiler
+from common.utils import myprint, lazy, color, dumpToFile, dumpJsonToFile, dumpListToFile, dumpListOfListToFile
+from tidesCache import TidesCache
+from tidesClock import getClock
+from tidesRecord import TIDES, TideDay, dateKeyToOrdinal, minutesToTime
+from tidesSnapshot import TidesSnapshot, writeSnapshot
+
+# Parser, HTTP client, tides history and timeline modules (and their dependencies: requests,
+# sqlite3, pytz,...) are imported on first use: showing tides from the local cache file
+# (standalone mode) only needs the modules above.
 
 class color:
     PURPLE    = '\033[95m'
@@ -37,9 +47,10 @@ METSERVICE_HTTP_REQUESTS = {
         "info" : "Conect to metservice.intnet.mu and get index page to retrieve tides table",
         "rqst" : {
             "type" : 'GET',
-            "url"  : 'http://metservice.intnet.mu/sun-moon-and-tides-tides-mauritius.php',
+            "url"  : '/sun-moon-and-tides-tides-mauritius.php',	# Relative to upstreamBaseUrl()
             "headers" : {
             },
+            "conditional" : True,	# Skip parsing if page not modified since last successful parse
         },
         "resp" : {
             "code" : 200,
@@ -50,24 +61,61 @@ METSERVICE_HTTP_REQUESTS = {
     },
 }
 
+# Returned by _executeRequest() for a conditional request if the page was not modified
+NOT_MODIFIED = object()
+
+# Base URL of MetService server (-U/--upstream: local simulator, stand-in,...)
+def upstreamBaseUrl():
+    return (getattr(config, 'UPSTREAM_URL', None) or mg.UPSTREAM_BASE_URL).rstrip('/')
+
+# Cells of a day row: date, then time and height of each tide
+DAY_ROW_CELLS = 1 + 2 * len(TIDES)
+
+# Days before today kept in the local cache file when it is updated
+CACHE_RETENTION_DAYS = 31
+
+PARSE_DURATION = metrics.histogram('parse_duration_seconds', 'Time spent parsing the tides page (including cache file update)')
+
 cacheUpdated = False
             
 class MetServiceTides:
-    def __init__(self, session):
-        self._session  = session
+    def __init__(self, client):
+        self._client  = client		# upstream.UpstreamClient
         # Dict to save cookies from server
         self._cookies = dict()
+        # Tides information parsed from server response (None if page not modified)
+        self.info = None
+        # (url, response, tag) of last conditional request, to save its validators once processed
+        self._validated = None
+        # Generation of the cache file written (None if not written)
+        self.generation = None
         
     def getTidesInformation(self):
         # Execute request to get the tides raw information
         respText = self._executeRequest('initialPage')
-        if 'ErRoR' in respText:
+        if respText is NOT_MODIFIED:
+            myprint(1, 'Tides page not modified. Keeping local cache file')
+            os.utime(mg.dataCachePath)	# Local cache is up to date
+            return 0
+        if not respText or 'ErRoR' in respText:
             myprint(1, 'Error retrieving information from server')
             return -1
 
         # Parse returned information. Create/Update local cache file
-        info = self._parseTidesPage(respText)
-        myprint(2, json.dumps(info, indent=4))
+        try:
+            with metrics.timer(PARSE_DURATION):
+                self.info = self._parseTidesPage(respText)
+        except ValueError as e:
+            myprint(0, 'Unexpected layout of tides page (%s). Keeping local cache file' % e)
+            return -1
+        myprint(2, lazy(json.dumps, self.info, indent=4))
+        if self.generation is None:
+            myprint(0, 'Unable to write data cache file %s' % mg.dataCachePath)
+            return -1
+
+        # Page successfully processed: next request may be conditional
+        if self._validated:
+            self._client.saveValidators(*self._validated)
         return 0
     
     # Build a string containing all cookies passed as parameter in a list 
@@ -83,7 +131,7 @@ class MetServiceTides:
 
     # Update our cookie dict
     def _updateCookies(self, cookies):
-        for cookie in self._session.cookies:
+        for cookie in self._client.session.cookies:
             if cookie.value == 'undefined' or cookie.value == '':
                 myprint(2,'Skipping cookie with undefined value %s' % (cookie.name))
                 continue
@@ -97,11 +145,13 @@ class MetServiceTides:
                 myprint(2,'Cookie not modified:', cookie.name)                
 
     def _executeRequest(self, name):
+        import requests	# Loaded only when needed
+
         dt_now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
         rqst = METSERVICE_HTTP_REQUESTS[name]
         myprint(1, '%s: Executing request "%s": %s' % (dt_now, name, rqst["info"]))
-        myprint(2, json.dumps(rqst, indent=4))
+        myprint(2, lazy(json.dumps, rqst, indent=4))
 
         hdrs = hh.HttpHeaders()
 
@@ -121,7 +171,7 @@ class MetServiceTides:
                 hdrs.setHeader(k, v)
 
         rqstType = rqst["rqst"]["type"]
-        rqstURL  = rqst["rqst"]["url"]
+        rqstURL  = upstreamBaseUrl() + rqst["rqst"]["url"]
         try:
             rqstStream = rqst["rqst"]["stream"]
         except:
@@ -132,40 +182,56 @@ class MetServiceTides:
         except:
             csvStream = False
             
+        # Conditional request, only if the local cache exists. Validators are bound to the current
+        # month, as the parsing of the page depends on it
+        validate = rqst["rqst"].get("conditional", False) and not rqstStream
+        conditional = validate and os.path.isfile(mg.dataCachePath)
+        if validate:
+            tag = mauritiusLocalMonthYear()
+        if conditional:
+            for k,v in self._client.conditionalHeaders(rqstURL, tag).items():
+                hdrs.setHeader(k, v)
+
         myprint(1,'Request type: %s, Request URL: %s' % (rqstType, rqstURL))
-        myprint(2,'Request Headers:', json.dumps(hdrs.headers, indent=2))
+        myprint(2,'Request Headers:', lazy(json.dumps, hdrs.headers, indent=2))
 
         errFlag = False
         
         if rqstType == 'GET':
             try:
                 myprint(2,'Request Stream:', rqstStream, 'CSV Stream:', csvStream)
-                r = self._session.get(rqstURL, headers=hdrs.headers, stream=rqstStream)
+                r = self._client.request('GET', rqstURL, headers=hdrs.headers, stream=rqstStream)
             except requests.exceptions.RequestException as e:
                 errFlag = True
+                error = e	# 'e' is unbound at the end of the except clause
                 
         elif rqstType == 'POST':
             rqstPayload  = rqst["rqst"]["payload"]
             myprint(1,"payload=%s" % rqstPayload)
             try:
-                r = self._session.post(rqstURL, headers=hdrs.headers, data=rqstPayload)
+                r = self._client.request('POST', rqstURL, headers=hdrs.headers, data=rqstPayload)
             except requests.exceptions.RequestException as e:
                 errFlag = True
+                error = e	# 'e' is unbound at the end of the except clause
                 
         else:	# OPTIONS
             assert(rqstType == 'OPTIONS')
             try:
-                r = self._session.options(rqstURL, headers=hdrs.headers)
+                r = self._client.request('OPTIONS', rqstURL, headers=hdrs.headers)
             except requests.exceptions.RequestException as e:
                 errFlag = True
+                error = e	# 'e' is unbound at the end of the except clause
 
         if errFlag:
-            errorMsg = 'ErRoR while retrieving information: %s' % (e) # Dont't change the cast for ErRoR  !!!!
+            errorMsg = 'ErRoR while retrieving information: %s' % (error) # Dont't change the cast for ErRoR  !!!!
             myprint(0, errorMsg)
             return errorMsg
 
         myprint(1,'Response Code:',r.status_code)
 
+        if conditional and r.status_code == 304:
+            return NOT_MODIFIED
+
         if r.status_code != rqst["resp"]["code"]:
             myprint(1,'Invalid Status Code: %d (expected %d). Reason: %s' % (r.status_code, rqst["resp"]["code"], r.reason))
             if rqst["returnText"]:
@@ -173,11 +239,17 @@ class MetServiceTides:
             else:
                 return
 
-        myprint(2,'Response Headers:', json.dumps(dict(r.headers), indent=2))
+        myprint(2,'Response Headers:', lazy(json.dumps, dict(r.headers), indent=2))
+
+        if validate:
+            if conditional and self._client.isUnchanged(rqstURL, r.content, tag):
+                myprint(1, 'Same page as last time')
+                return NOT_MODIFIED
+            self._validated = (rqstURL, r, tag)
         
-        # Optional parameter "dumpResponse"
+        # Optional parameter "dumpResponse" (saved next to the cache file)
         try:
-            outputFile = os.path.join(mg.moduleDirPath, rqst["resp"]["dumpResponse"])
+            outputFile = os.path.join(os.path.dirname(mg.dataCachePath), rqst["resp"]["dumpResponse"])
             if rqstStream:
                 if csvStream:
                     with open(outputFile, 'wb') as f:
@@ -203,164 +275,560 @@ class MetServiceTides:
             return r.text
 
 
+    # Parse the tides page, merge its days into the tides history and the local cache file.
+    # Raise ValueError if the layout of the page is not the expected one (the cache file is
+    # then not modified)
     def _parseTidesPage(self, html):
-        soup = BeautifulSoup(html, 'html.parser')
 
-        data = []
+        tidesDict = self._extractTides(html)
 
-        # Assuming the first table *IS* the tides table :(
-        table = soup.find('table')
-        table_body = table.find('tbody')
+        # Merge into tides history (before updating the cache file, which triggers a reload by readers)
+        getStore().merge(tidesDict)
 
-        rows = table_body.find_all('tr')
-        for row in rows:
-            cols = row.find_all('td')
-            cols = [ele.text.strip() for ele in cols]
-            data.append([ele for ele in cols if ele]) # Get rid of empty values
+        # Update local cache file (days of the page replace those of the cache)
+        tidesDict = mergeWithCacheFile(tidesDict, getClock().today())
+        self.generation = writeCacheFile(tidesDict)
+        return tidesDict
 
-        # Get month name from first element of the first list
-        myprint(1,data[0][0])
-        
-        monthName = data[0][0].replace("'", "").split()[0]
-        myprint(1, monthName)
-        
-        year = date.today().year
+    # Return a dict (ddmmyy -> TideDay) of the days of the tides table of the page. No I/O.
+    # Raise ValueError if the layout of the page is not the expected one
+    def _extractTides(self, html):
 
-        monthYear = '%s %s' % (monthName, year)
-        mmyy = datetime.strptime(monthYear, '%B %Y').strftime('%m%y')
-        myprint(1, monthYear, mmyy)
+        # Rows of the tides table, as lists of non-empty cell texts, read as the page is parsed
+        data = (
+            [ele for ele in cols if ele]	# Get rid of empty values
+            for cols in self._tableRows(html)
+        )
 
-        #currMonthYear = mauritiusLocalMonthYear()         # current monthName and Year
-        #myprint(1, 'Current Month Year', currMonthYear)
-        currMonth = mauritiusLocalMonth()         # current monthName
-        myprint(1, 'Current Month', currMonth)
-        
-        oneDayDict = dict()
-        oneMonthDict = dict()
-        
-        # Parse first month (current month) only
+        today = getClock().today()
+        months = list()		# (year, month) of the month tables of the page
+        tidesDict = dict()
+
+        # The table holds, for each month, a row with the month name, header rows and one row per day
         for oneDayList in data:
 
             myprint(2, oneDayList, len(oneDayList))
-            
-            #if len(oneDayList) == 1 and oneDayList[0] != currMonthYear:
-            if not oneDayList or len(oneDayList) == 1 and oneDayList[0] != currMonth:
-                myprint(1, 'End of month %s: %d entries in dict' % (monthYear,len(oneMonthDict)))
-                break
 
-            if oneDayList[0].isnumeric():	# skip header lines
-                oneDayDict.clear()
-                k = format(int(oneDayList[0]), '02d') + mmyy  # date (ddmmyy) as key
-                oneMonthDict[k] = [unicodedata.normalize("NFKD", fld).lstrip() for fld in oneDayList]                
-        myprint(1, oneMonthDict)
+            if not oneDayList:
+                continue
 
-        # Update local cache file
-        dumpJsonToFile(mg.DATA_CACHE_FILE, oneMonthDict)
-        return oneMonthDict
+            if oneDayList[0].isnumeric():	# Day of current month
+                if not months:
+                    raise ValueError('row of day %s before any month name' % oneDayList[0])
+                if len(oneDayList) != DAY_ROW_CELLS:
+                    raise ValueError('%d cells in row of day %s (expected %d)' % (len(oneDayList), oneDayList[0], DAY_ROW_CELLS))
+                year, month = months[-1]
+                k = '%02d%02d%02d' % (int(oneDayList[0]), month, year % 100)  # date (ddmmyy) as key
+                tidesDict[k] = TideDay.fromList(k, [fld if fld.isascii() else unicodedata.normalize("NFKD", fld).lstrip() for fld in oneDayList])
+
+            elif len(oneDayList) == 1:		# Month name
+                try:
+                    months.append(monthOfTable(oneDayList[0], months[-1] if months else None, today))
+                except ValueError:
+                    if not months:
+                        raise
+                    myprint(1, 'Skipping row %s' % oneDayList)
+                    continue
+                myprint(1, 'Month %s: %02d/%d' % (oneDayList[0], months[-1][1], months[-1][0]))
+
+        if not tidesDict:
+            raise ValueError('no tides in table')
+        myprint(1, '%d days in %d month(s)' % (len(tidesDict), len(months)))
+        return tidesDict
+
+    # Return an iterator of the rows of the tides table, using the configured parser. The
+    # streaming parser falls back to BeautifulSoup if it doesn't find any row
+    def _tableRows(self, html):
+        import tidesParser as tp	# Loaded only when needed
+
+        if getattr(config, 'PARSER', 'fast') == 'bs4':
+            return tp.iterTableRowsBs4(html)
+
+        rows = tp.iterTableRows(html)
+        firstRow = next(rows, None)
+        if firstRow is None:
+            myprint(0, 'No tides table found by fast parser. Using BeautifulSoup')
+            return tp.iterTableRowsBs4(html)
+        return itertools.chain((firstRow,), rows)
 
 
 ####
-# Load data from local cache. If cache is older than delay, return None to force a reload
-def loadDataFromCacheFile():
+# Local cache file format: {"generation": N, "updated": time, "tides": {ddmmyy: record}}
+# (see tidesRecord.py). The generation is incremented on each write, and is written first so
+# that readers can check it without parsing the whole file. A bare dict of legacy lists
+# (legacy format) is generation 0.
+CACHE_HEADER_RE = re.compile(r'\{"generation": (\d+)')
+CACHE_HEADER_SIZE = 64
 
-    if not os.path.isfile(mg.dataCachePath):	# Cache file does not exists
+# Return the generation of the local cache file (0 for legacy format), or None if it can't be read
+def cacheFileGeneration():
+
+    try:
+        with open(mg.dataCachePath, 'r', encoding='utf-8') as infile:
+            header = infile.read(CACHE_HEADER_SIZE)
+    except OSError:
         return None
-    
-    if isFileOlderThanXMinutes(mg.dataCachePath, minutes=config.UPDATEDELAY):
-        if config.DEBUG:
-            t = os.path.getmtime(mg.dataCachePath)
-            dt = datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M:%S')
-            myprint(1, f'Cache file outdated {dt}. Deleting and reloading from MetService server')
-        # Remove data cache file and reload from server
-        os.remove(mg.dataCachePath)
-        return None # Force a reload
+    m = CACHE_HEADER_RE.match(header)
+    return int(m.group(1)) if m else 0
 
+
+# Load data from local cache. Return (generation, dict ddmmyy -> TideDay), or (None, None) on error.
+# Outdated data is still returned (see cacheFileAge())
+def readCacheFile():
+
+    if not os.path.isfile(mg.dataCachePath):	# Cache file does not exists
+        return None, None
+    
     myprint(1, 'Loading data from local cache')
 
     try:
-        with open(mg.dataCachePath, 'r') as infile:
-            data = infile.read()
-            res = json.loads(data)
-            return res
+        with open(mg.dataCachePath, 'r', encoding='utf-8') as infile:
+            res = json.load(infile)
     except Exception as error: 
-        myprint(0, f"Unable to open data cache file {mg.dataCachePath}")
+        myprint(0, f"Unable to open data cache file {mg.dataCachePath}: {error}")
+        return None, None
+
+    generation, tides = (res['generation'], res['tides']) if 'generation' in res and 'tides' in res else (0, res)	# Legacy format
+    try:
+        return generation, {k: TideDay.fromAny(k, v) for k,v in tides.items()}
+    except (TypeError, ValueError) as error:
+        myprint(0, f"Invalid data cache file {mg.dataCachePath}: {error}")
+        return None, None
+
+
+def loadDataFromCacheFile():
+    return readCacheFile()[1]
+
+
+####
+# Binary snapshot of the tides history and cache file (see tidesSnapshot.py), written with
+# each cache file update
+def snapshotPath():
+    return os.path.join(os.path.dirname(mg.dataCachePath), mg.DATA_SNAPSHOT_FILE)
+
+# Return the snapshot of given generation, or None if missing, invalid or of another generation
+def openSnapshot(generation):
+    try:
+        snapshot = TidesSnapshot(snapshotPath())
+    except (OSError, ValueError) as e:
+        myprint(1, 'No tides snapshot: %s' % e)
+        return None
+    return snapshot if snapshot.generation == generation else None
+
+# Load the tides table: the snapshot of the current cache file if any, else the cache file
+def readCache():
+    generation = cacheFileGeneration()
+    snapshot = openSnapshot(generation) if generation else None
+    if snapshot is not None:
+        myprint(1, 'Using tides snapshot (generation %d)' % generation)
+        return generation, snapshot
+    return readCacheFile()
+
+# Write the snapshot of the current cache file if missing (cache file of a previous version)
+def ensureSnapshot():
+    generation = cacheFileGeneration()
+    if not generation or openSnapshot(generation) is not None:
+        return
+    generation, data = readCacheFile()
+    if data:
+        _writeSnapshot(data, generation)
+
+def _writeSnapshot(tidesDict, generation):
+    try:
+        writeSnapshot(snapshotPath(), _allDays(tidesDict), generation)
+    except (OSError, ValueError) as e:
+        myprint(0, 'Unable to write tides snapshot %s: %s' % (snapshotPath(), e))
+
+
+# Year and month of a month table of the tides page, from its title ("June", "June '22",
+# "June 2022"). Without a year, the first table is the month closest to 'today' and the next
+# ones follow it (December -> January: next year). Raise ValueError if not a month name
+def monthOfTable(title, previous, today):
+    words = title.replace("'", " ").split()
+    month = datetime.strptime(words[0], '%B').month
+    if len(words) > 1 and words[1].isdigit() and len(words[1]) in (2, 4):
+        year = int(words[1]) if len(words[1]) == 4 else 2000 + int(words[1])
+    elif previous:
+        year = previous[0] + (month < previous[1])
+    else:
+        current = today.year * 12 + today.month
+        year = min((today.year - 1, today.year, today.year + 1), key=lambda y: abs(y * 12 + month - current))
+    return year, month
+
+
+# Merge the days of a new page with those of the local cache file. Days older than
+# CACHE_RETENTION_DAYS are dropped (they remain in the tides history)
+def mergeWithCacheFile(tidesDict, today):
+    first = today.toordinal() - CACHE_RETENTION_DAYS
+    merged = {k: v for k,v in (readCacheFile()[1] or dict()).items() if v.ordinal >= first}
+    merged.update(tidesDict)
+    return dict(sorted(merged.items(), key=lambda kv: kv[1].ordinal))
+
+
+# Write the tides dict to the local cache file (atomically). Return the new generation, or None on error
+def writeCacheFile(tidesDict):
+
+    generation = max(cacheFileGeneration() or 0, cache.generation or 0) + 1
+
+    # Snapshot first: readers use it once the cache file of the same generation is written
+    _writeSnapshot(tidesDict, generation)
+
+    content = {
+        'generation' : generation,
+        'updated'    : int(time.time()),
+        'tides'      : {k: v.record() for k,v in tidesDict.items()},
+    }
+    if dumpJsonToFile(mg.dataCachePath, content):
         return None
+    return generation
+
+
+# Return the age of the local cache file in minutes, or None if it does not exist
+def cacheFileAge():
+
+    try:
+        return (time.time() - os.path.getmtime(mg.dataCachePath)) / 60
+    except OSError:
+        return None
+
 
+# Client used for all requests to MetService server (connection pool, validators). Created on first use
+upstreamClient = None
+
+def getUpstreamClient():
+    global upstreamClient
+
+    if upstreamClient is None:
+        from upstream import UpstreamClient	# Loaded only when needed
+        upstreamClient = UpstreamClient(mg.validatorsPath)
+    return upstreamClient
+
+
+# Outcome of refreshes of the cache file
+REFRESH_UPDATED   = metrics.counter('refreshes', 'Refreshes of the cache file, by result', result='updated')
+REFRESH_UNCHANGED = metrics.counter('refreshes', 'Refreshes of the cache file, by result', result='unchanged')
+REFRESH_FAILED    = metrics.counter('refreshes', 'Refreshes of the cache file, by result', result='failed')
+REFRESH_DURATION  = metrics.histogram('refresh_duration_seconds', 'Duration of refreshes of the cache file')
 
 def getTidesInfoFromMetServiceServer():
     global cacheUpdated
     
-    with requests.session() as session:
-        # Create connection with MetService server
-        mst = MetServiceTides(session)
-        # Get information from server
+    mst = MetServiceTides(getUpstreamClient())
+    # Get information from server
+    with metrics.timer(REFRESH_DURATION), profiler.profiled('refresh', 'refresh'):
         res = mst.getTidesInformation()
-        if not res:
+    if not res:
+        if mst.info is None:	# Page not modified
+            REFRESH_UNCHANGED.inc()
+            cache.revalidated()
+        else:
             myprint(1, 'Cache file updated')
+            REFRESH_UPDATED.inc()
             cacheUpdated = True
-        return res
+            cache.publish(mst.info, mst.generation)
+    else:
+        REFRESH_FAILED.inc()
+    return res
 
 
+####
+# Background refresh of the local cache file. At most one refresh runs at a time and a
+# failed refresh is not retried before REFRESH_RETRY_DELAY seconds.
+REFRESH_RETRY_DELAY = 60
+
+refreshLock = threading.Lock()
+refreshThread = None
+lastRefreshAttempt = None
+
+def _refresh():
+    dt_now = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    myprint(1, 'Revalidating cache file from server at %s' % dt_now)
+    res = getTidesInfoFromMetServiceServer()
+    if res:
+        myprint(0, 'Failed to create/update local data cache')
+    
+def refreshInBackground():
+    global refreshThread, lastRefreshAttempt
+
+    with refreshLock:
+        if refreshThread and refreshThread.is_alive():
+            return False	# Already running
+        now = time.monotonic()
+        if lastRefreshAttempt is not None and now - lastRefreshAttempt < REFRESH_RETRY_DELAY:
+            return False	# Too soon
+        lastRefreshAttempt = now
+        refreshThread = threading.Thread(target=_refresh, name='cacheRefresher', daemon=True)
+        refreshThread.start()
+        return True
+
+# Standalone mode: refresh the cache file in a detached process (-nc), so that the command
+# exits as soon as the tides are shown, even if the server doesn't answer. Refreshes started
+# by all commands are throttled by the time of a stamp file next to the cache file: not more
+# than one every REFRESH_RETRY_DELAY seconds
+def refreshDetached():
+    import subprocess	# Loaded only when needed
+
+    stamp = os.path.join(os.path.dirname(mg.dataCachePath), mg.REFRESH_STAMP_FILE)
+    try:
+        if time.time() - os.path.getmtime(stamp) < REFRESH_RETRY_DELAY:
+            return False	# Running, or too soon
+    except OSError:
+        pass
+    try:
+        with open(stamp, 'w'):
+            pass
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'myMetServiceTides.py'),
+               '-nc', '--cache-dir', os.path.dirname(mg.dataCachePath), '-U', upstreamBaseUrl(),
+               '--parser', getattr(config, 'PARSER', 'fast')]
+        subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError as e:
+        myprint(0, 'Unable to start cache refresh: %s' % e)
+        return False
+    return True
+
+# Timeline of tide events and statistics of all known days. Built on first use, and again
+# after each reload of the cache file
+timeline = None
+stats = None
+
+def _resetTimeline(data):
+    global timeline, stats
+    timeline = None
+    stats = None
+
+# Return a dict (ddmmyy -> TideDay) of all known days: tides history and cache file
+def _allDays(data):
+    if isinstance(data, TidesSnapshot):	# Includes the tides history
+        return data
+    tidesDict = dict(getStore().all())
+    tidesDict.update(data)
+    return tidesDict
+
+def getTimeline(data):
+    global timeline
+    from tidesTimeline import TidesTimeline	# Loaded only when needed
+
+    tl = timeline
+    if tl is None:
+        tl = timeline = TidesTimeline(_allDays(data))
+    return tl
+
+def getStats(data):
+    global stats
+    from tidesStats import TidesStats	# Loaded only when needed (NumPy)
+
+    st = stats
+    if st is None:
+        st = stats = TidesStats(_allDays(data))
+    return st
+
+# In-process copy of the cache file, shared by all API requests
+cache = TidesCache(readCache, refreshInBackground, onReload=_resetTimeline, peek=cacheFileGeneration)
+
+def _cacheAgeSeconds():
+    age = cacheFileAge()
+    return age * 60 if age is not None else None
+
+metrics.gauge('cache_age_seconds', 'Age of the local cache file', _cacheAgeSeconds)
+metrics.gauge('cache_generation', 'Generation of the tides table served', lambda: cache.generation)
+
+# Tides history. Created on first use (seeded with the local cache file if empty)
+store = None
+
+def getStore():
+    global store
+
+    if store is None:
+        from tidesStore import TidesStore	# Loaded only when needed
+        s = TidesStore(mg.dataStorePath)
+        if not s.count():
+            data = loadDataFromCacheFile()
+            if data:
+                s.merge(data)
+        store = s
+    return store
+
+
+# Return the tides information (TideDay) of given date (ddmmyy), or None
 def getTidesInfo(tidesDate):
 
-    # Load data from local cache
-    data = loadDataFromCacheFile()
+    # Get data from in-process cache (reloaded from local cache file when modified)
+    data = cache.get()
     if not data:
         myprint(0, 'Unable to retrieve tides information from cache file')
         return None
 
-    # Check data format
-    try:
-        day,firstHTT,firstHTH,secHTT,secHTH,firstLTT,firstLTH,secLTT,secLTH = data[tidesDate]
-    except:
+    # Dates out of the cache file are looked up in the tides history
+    info = data.get(tidesDate) or getStore().get(tidesDate)
+    if info is None:
         myprint(0, f'Unable to retrieve tides information for {tidesDate}')
+    return info
+
+
+# Return a list of {'id': ddmmyy, 'tides': TideDay} or {'id': ddmmyy, 'error': message}, one for each
+# requested date, all read from the same snapshot of the cache file
+def getTidesInfoBatch(tidesDates):
+
+    data = cache.get()
+    if not data:
+        myprint(0, 'Unable to retrieve tides information from cache file')
+        return [{'id': k, 'error': 'Tides information unavailable'} for k in tidesDates]
+
+    # Dates out of the cache file are looked up in the tides history, in one query
+    missing = [k for k in tidesDates if k not in data]
+    history = getStore().getMany(missing) if missing else dict()
+
+    res = list()
+    for k in tidesDates:
+        info = data.get(k) or history.get(k)
+        if info:
+            res.append({'id': k, 'tides': info})
+        else:
+            try:
+                dateKeyToOrdinal(k)
+            except ValueError:
+                res.append({'id': k, 'error': 'Invalid date (expected ddmmyy)'})
+            else:
+                res.append({'id': k, 'error': 'Tides information not found'})
+    return res
+
+
+# Return an iterator of (ddmmyy, info) for each day in [fromDate, toDate] found in the tides history
+def getTidesRange(fromDate, toDate):
+
+    # Same availability rules as getTidesInfo()
+    if not cache.get():
+        myprint(0, 'Unable to retrieve tides information from cache file')
+        return iter(())
+
+    return getStore().range(fromDate, toDate)
+
+
+# Return the list of the next n tide events (optionally of given type: 'high' or 'low') from now
+def getNextTides(kind=None, n=1):
+
+    data = cache.get()
+    if not data:
+        myprint(0, 'Unable to retrieve tides information from cache file')
         return None
-    else:
-        return data[tidesDate]
 
-    
-def mauritiusLocalTime():
+    return getTimeline(data).next(getClock().now(), kind, n)
 
-    local_dt = datetime.now()	# Local datetime
-    
-    mauritius = pytz.timezone('Indian/Mauritius')
-    mauritius_dt = local_dt.astimezone(mauritius)
-    myprint(1, 'Mauritius Local Time:', mauritius_dt.strftime('%d/%m/%Y %H:%M:%S %Z%z'))
-    return mauritius_dt.time()
 
-def mauritiusLocalMonthYear():
+# Return the statistics (dict) of given month (1..12) of given year, or of the whole year if
+# month is None. None if unavailable
+def getTidesStats(year, month=None):
 
-    local_dt = datetime.now()	# Local datetime
-    
-    mauritius = pytz.timezone('Indian/Mauritius')
-    mauritius_dt = local_dt.astimezone(mauritius)
-    my = mauritius_dt.strftime('%B %Y')
-    myprint(1, 'Mauritius Local Month Year:', my)
-    return my
+    data = cache.get()
+    if not data:
+        myprint(0, 'Unable to retrieve tides information from cache file')
+        return None
 
-def mauritiusLocalMonth():
+    st = getStats(data)
+    return st.year(year) if month is None else st.month(year, month)
 
-    local_dt = datetime.now()	# Local datetime
-    
-    mauritius = pytz.timezone('Indian/Mauritius')
-    mauritius_dt = local_dt.astimezone(mauritius)
-    m = mauritius_dt.strftime('%B')
-    myprint(1, 'Mauritius Local Month:', m)
-    return m
+
+# Return (height, rising) of the water at timestamp 'at' (seconds since epoch), interpolated
+# between high and low waters. (None, None) if unknown
+def getWaterHeight(at):
+
+    data = cache.get()
+    if not data:
+        myprint(0, 'Unable to retrieve tides information from cache file')
+        return None, None
+
+    return getTimeline(data).curve().heightAt(at)
+
+
+# Return the list of interpolated water heights of given date (ddmmyy, Mauritius-local),
+# every 'step' seconds from midnight (None if unknown), or None if unavailable
+def getTidesCurve(tidesDate, step):
+
+    data = cache.get()
+    if not data:
+        myprint(0, 'Unable to retrieve tides information from cache file')
+        return None
+
+    start = getClock().midnight(date.fromordinal(dateKeyToOrdinal(tidesDate)))
+    count = (24 * 3600 - 1) // step + 1
+    return getTimeline(data).curve().series(start, step, count)
+
+
+# Mauritius-local time, date and month (see tidesClock.py)
+def mauritiusLocalTime():
+    return getClock().localNow().time()
+
+def mauritiusLocalMonthYear():
+    return getClock().today().strftime('%B %Y')
+
+def mauritiusLocalMonth():
+    return getClock().today().strftime('%B')
 
 def mauritiusLocalDate():
+    return getClock().today()
+
+# Print the statistics of a month (year, month) or of a year (month is None)
+def showTidesStats(year, month=None):
+
+    # Same cache rules as showTidesInfo(), without background refresh
+    if cacheFileAge() is None:
+        res = getTidesInfoFromMetServiceServer()
+        if res:
+            myprint(0, 'Failed to create/update local data cache')
+            return -1
+
+    st = getTidesStats(year, month)
+    if st is None:
+        myprint(0, 'No tides information for %s' % (year if month is None else '%02d/%d' % (month, year)))
+        return -1
+
+    if month is None:
+        title = '%d' % year
+    else:
+        title = date(year, month, 1).strftime('%B %Y')
+    print('{B}Tides statistics for {T}{E} ({D} days)'.format(B=color.BOLD, E=color.END, T=title, D=st['days']))
+    print('{L:<19}: {V}'.format(L='Mean High Water', V=st['mhw']))
+    print('{L:<19}: {V}'.format(L='Mean Low Water', V=st['mlw']))
+    print('{L:<19}: {V}'.format(L='Mean Range', V=st['meanRange']))
+
+    if month is not None:
+        for kind in ('spring', 'neap'):
+            days = [d['date'][:2] for d in st['daily'] if d['type'] == kind]
+            print('{L:<19}: {V}'.format(L=kind.capitalize() + ' Tide Days', V=' '.join(days) or '-'))
+        if config.VERBOSE:
+            for d in st['daily']:
+                print('{L:<19}: {R:<6}{K}'.format(L=d['date'], R=str(d['range']), K=d['type'] or ''))
+        return 0
+
+    for m in st['months']:
+        print('{L:<19}: MHW {H:<6} MLW {W:<6} Range {R}'.format(L=date(year, int(m['month'][:2]), 1).strftime('%B'),
+                                                                 H=str(m['mhw']), W=str(m['mlw']), R=m['meanRange']))
+    labels = {'highestHighWater': 'Highest High Water', 'lowestLowWater': 'Lowest Low Water',
+              'largestRange': 'Largest Range', 'smallestRange': 'Smallest Range'}
+    for k,e in st['extremes'].items():
+        if e is None:
+            continue
+        if 'height' in e:
+            print('{L:<19}: {H} ({D} {T})'.format(L=labels[k], H=e['height'], D=e['date'], T=e['time']))
+        else:
+            print('{L:<19}: {R} ({D})'.format(L=labels[k], R=e['range'], D=e['date']))
+    return 0
 
-    local_dt = datetime.now()	# Local datetime
-    
-    mauritius = pytz.timezone('Indian/Mauritius')
-    mauritius_dt = local_dt.astimezone(mauritius)
-    myprint(1, 'Mauritius Local Date:', mauritius_dt.strftime('%d/%m/%Y %H:%M:%S %Z%z'))
-    return mauritius_dt.date()
 
 def showTidesInfo(tidesDate):
 
-    # Load data from local cache
-    data = loadDataFromCacheFile()
+    # Load data from local cache. Outdated data is served (stale) while it is refreshed in background
+    age = cacheFileAge()
+    if age is not None and age > config.MAX_STALENESS:
+        myprint(1, 'Cache file is too old (%d minutes). Ignoring it' % age)
+        data = None
+    else:
+        data = readCache()[1]	# Snapshot (mapped) of the cache file if any
+    stale = bool(data) and age > config.UPDATEDELAY
+    if stale:
+        myprint(1, 'Cache file outdated (%d minutes). Refreshing in background' % age)
+        refreshDetached()
     if not data:
         myprint(1, 'Failed to load tides data from local cache file. Retrieving data from server')
         # Read data from server
@@ -369,7 +837,7 @@ def showTidesInfo(tidesDate):
             myprint(0, 'Failed to create/update local data cache')
             return -1
 
-        data = loadDataFromCacheFile()
+        data = readCache()[1]
         # Assuming no error
         
         if config.DEBUG:
@@ -387,11 +855,8 @@ def showTidesInfo(tidesDate):
              '2nd Low Tide Time',
              '2nd Low Tide Height']
 
-    # example: ["5", "03:17", "54", "18:03", "49", "10:02", "26", "-", "-"]
-
-    try:
-        day,firstHTT,firstHTH,secHTT,secHTH,firstLTT,firstLTH,secLTT,secLTH = data[tidesDate]
-    except:
+    info = data.get(tidesDate) or getStore().get(tidesDate)
+    if info is None:
         myprint(0, f'Invalid/Not found input date: {tidesDate}')
         return -1
 
@@ -399,30 +864,32 @@ def showTidesInfo(tidesDate):
         s = "{B}Tides for date: {DATE}{E} {CA}".format(
             B=color.BOLD,
             E=color.END,
-            CA="(+)" if cacheUpdated else "",
-            DATE=datetime.strptime(tidesDate, '%d%m%y').strftime("%a %d %b, %Y"))
+            CA="(+)" if cacheUpdated else "(stale)" if stale else "",
+            DATE=info.date.strftime("%a %d %b, %Y"))
         print(s)
         
-        # build a list of tuples, each tuple containing: (time of tide, height of tide, label)
+        # build a list of tuples, each tuple containing: (time of tide, height of tide, label, minutes since midnight)
+        record = info.record()
         l = list()
-        for i in range(1, 9, 2):	# Skip over date field and height
-            if data[tidesDate][i] == '-':
+        for i in range(0, 8, 2):	# (time, height) pairs
+            if record[i] is None:
                 continue		# remove phantom tide
-            l.append((data[tidesDate][i], data[tidesDate][i+1], labels[i]))
+            l.append((minutesToTime(record[i]), record[i+1], labels[i+1], record[i]))
             
-        # Bubble sort the list by ascending time
-        bubbleSort(l)
+        # Sort the list by ascending time
+        l.sort(key=lambda ele: ele[3])
         
         # If reqesting today's tides (using Mauritius time), highlight next tide time
         #if datetime.strptime(tidesDate, '%d%m%y').date() == datetime.today().date():
-        if datetime.strptime(tidesDate, '%d%m%y').date() == mauritiusLocalDate():
-            timeNowInMauritius = mauritiusLocalTime()
-            myprint(1, "Today's local date:", datetime.now(), "Mauritius local time", timeNowInMauritius)
+        clock = getClock()
+        today = clock.today()
+        if info.date == today:
+            secondsNow = clock.secondsSinceMidnight()
+            myprint(1, "Today's local date:", datetime.now(), "Mauritius local time", lazy(mauritiusLocalTime))
 
             nextTideNotFound = True
             for ele in l:
-                t = datetime.strptime(ele[0], '%H:%M').time()
-                if t >= timeNowInMauritius:
+                if ele[3] * 60 >= secondsNow:
                     if nextTideNotFound:
                         nextTideNotFound = False
                         s = "{L:<19}: {B}{T:6}{E}({H}) {B}*{E}".format(L=ele[2], T=ele[0], H=ele[1], B=color.BOLD, E=color.END)
@@ -432,7 +899,7 @@ def showTidesInfo(tidesDate):
                     #s = "{L:<19}: {T:6}({H})".format(L=ele[2], T=ele[0], H=ele[1])
                     s = "{I}{L:<19}: {T:6}({H}){E}".format(I=color.ITALIC, E=color.END, L=ele[2], T=ele[0], H=ele[1])
                 print(s)
-        elif datetime.strptime(tidesDate, '%d%m%y').date() > mauritiusLocalDate():
+        elif info.date > today:
             # Tides request for a day in the future
             for ele in l:
                 s = "{L:<19}: {T:6}({H})".format(L=ele[2], T=ele[0], H=ele[1])
@@ -441,6 +908,6 @@ def showTidesInfo(tidesDate):
             for ele in l:
                 s = "{G}{L:<19}: {T:6}({H}){E}".format(G=color.GREYED, E=color.END, L=ele[2], T=ele[0], H=ele[1])
                 print(s)
-    else:	# Short output
-        print(data[tidesDate])
+    else:	# Short output (legacy list)
+        print(info.toList())
     return 0
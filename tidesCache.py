@@ -0,0 +1,159 @@
+# In-process cache of the tides table (local data cache file parsed once, served from memory)
+#
+# Stale-while-revalidate: once the cache file is older than the update delay, its content
+# is still served (marked as stale) while a single background refresh is started. Data
+# older than the maximum staleness is never served.
+#
+# The cache file is replaced atomically by the refresher, with a new generation number.
+# Readers never see a partial file, and only reload it when its generation changes. The
+# table is then, when available, the memory-mapped binary snapshot of the same generation
+# (see tidesSnapshot.py), shared by all processes, rather than a dict parsed from the file.
+
+import os
+import threading
+import time
+
+import myGlobals as mg
+import config
+import metrics
+
+from common.utils import myprint
+
+# Minimum delay (in seconds) between two checks of the cache file status
+CACHE_CHECK_INTERVAL = 1.0
+
+# Lookups served from memory (hit), or after (re)loading the cache file or with no data (miss)
+CACHE_HITS   = metrics.counter('cache_lookups', 'Lookups of the in-process tides table', result='hit')
+CACHE_MISSES = metrics.counter('cache_lookups', 'Lookups of the in-process tides table', result='miss')
+CACHE_STALE  = metrics.counter('cache_stale_serves', 'Lookups served with data older than the update delay')
+
+class TidesCache:
+    def __init__(self, loader, refresher, onReload=None, peek=None):
+        self._loader    = loader	# Function returning (generation, tides mapping) read from the cache file or snapshot
+        self._peek      = peek		# Function returning the generation of the cache file (cheap)
+        self._refresher = refresher	# Function starting a background refresh of the cache file
+        self._onReload  = onReload	# Function called with the new tides dict after each reload
+        self._lock      = threading.Lock()
+        self._data      = None		# Table: ddmmyy -> TideDay (dict or TidesSnapshot)
+        self._signature = None		# (inode, mtime, size) of the file the table was loaded from
+        self._generation = None		# Generation of the table (0: legacy cache file)
+        self._checked   = 0.0		# Last time (monotonic) the file status was checked
+        self._valid     = False
+        self._stale     = False
+
+    # True if the table currently served is older than the update delay
+    @property
+    def stale(self):
+        return self._stale
+
+    # Modification time (seconds since epoch) of the cache file the table was loaded from
+    @property
+    def mtime(self):
+        return self._signature[1] / 1e9 if self._signature else None
+
+    # Generation of the table currently served
+    @property
+    def generation(self):
+        return self._generation
+
+    # Opaque string identifying the content of the table currently served
+    @property
+    def version(self):
+        if not self._signature:
+            return None
+        if self._generation:
+            return 'g%x' % self._generation
+        return '%x-%x' % (self._signature[1], self._signature[2])	# Legacy cache file
+
+    # Replace the function called to refresh stale data
+    def setRefresher(self, refresher):
+        self._refresher = refresher
+
+    # Publish a new tides table, just written to the cache file by the refresher
+    def publish(self, data, generation):
+        with self._lock:
+            try:
+                st = os.stat(mg.dataCachePath)
+                self._signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except OSError:
+                self._signature = None	# Will be reloaded from file on next check
+            self._data = data
+            self._generation = generation
+            self._stale = False
+            if self._onReload:
+                self._onReload(data)
+            self._checked = time.monotonic()
+            self._valid = self._signature is not None
+
+    # The cache file has been revalidated (touched) by the refresher: its content is unchanged
+    def revalidated(self):
+        with self._lock:
+            try:
+                st = os.stat(mg.dataCachePath)
+            except OSError:
+                self._valid = False
+                return
+            if self._signature and self._signature[0] == st.st_ino and self._signature[2] == st.st_size:
+                self._signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+                self._stale = False
+            else:
+                self._valid = False
+
+    # Return the tides table, reloading it only if the cache file has been modified
+    def get(self):
+        now = time.monotonic()
+        if self._valid and now - self._checked < CACHE_CHECK_INTERVAL:
+            CACHE_HITS.inc()
+            if self._stale:
+                CACHE_STALE.inc()
+            return self._data
+
+        with self._lock:
+            try:
+                st = os.stat(mg.dataCachePath)
+            except OSError:
+                self._drop()
+                self._refresher()
+                CACHE_MISSES.inc()
+                return None
+
+            age = time.time() - st.st_mtime
+            if age > config.MAX_STALENESS * 60:
+                myprint(0, 'Cache file is %d minutes old (max staleness: %d). Not serving it' % (age // 60, config.MAX_STALENESS))
+                self._drop()
+                self._refresher()
+                CACHE_MISSES.inc()
+                return None
+
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+            hit = True
+            if signature != self._signature or self._data is None:
+                if self._data is not None and self._generation and self._peek and self._peek() == self._generation:
+                    myprint(1, 'Cache file revalidated (generation %d)' % self._generation)
+                    self._signature = signature
+                else:
+                    myprint(1, 'Cache file modified. Reloading tides table')
+                    hit = False
+                    self._generation, self._data = self._loader()
+                    self._signature = signature if self._data else None
+                    if self._data and self._onReload:
+                        self._onReload(self._data)
+
+            self._stale = age > config.UPDATEDELAY * 60
+            if self._stale:
+                myprint(1, 'Serving stale data (%d minutes old). Revalidating' % (age // 60))
+                self._refresher()
+
+            self._checked = now
+            self._valid = self._data is not None
+            (CACHE_HITS if hit and self._valid else CACHE_MISSES).inc()
+            if self._stale and self._valid:
+                CACHE_STALE.inc()
+            return self._data
+
+    def _drop(self):
+        self._data = None
+        self._signature = None
+        self._generation = None
+        self._valid = False
+        self._stale = False
@@ -0,0 +1,107 @@
+# Mauritius-local clock and calendar
+#
+# Tides are published in Mauritius-local time, whatever the time zone of the host. All
+# "now" and "today" lookups go through one clock object:
+# - the time zone object is created once (pytz is loaded on first use),
+# - the current day (date, ddmmyy key) and the instants of its start and of the next
+#   rollover (midnight) are computed once per day: "today" lookups are a comparison.
+# Tests and benchmarks can install a FrozenClock (see setClock()).
+
+from datetime import date, datetime, timedelta
+import time
+
+TIMEZONE = 'Indian/Mauritius'
+
+class Clock:
+    def __init__(self, tzName=TIMEZONE):
+        self._tzName = tzName
+        self._tz     = None
+        self._day    = None		# (start, next rollover, date, ddmmyy) of current day
+
+    @property
+    def tz(self):
+        if self._tz is None:
+            import pytz	# Loaded only when needed
+            self._tz = pytz.timezone(self._tzName)
+        return self._tz
+
+    # Current time (seconds since epoch)
+    def now(self):
+        return time.time()
+
+    # Current local time (aware datetime)
+    def localNow(self):
+        return self.fromTimestamp(self.now())
+
+    # Local time (aware datetime) of a timestamp
+    def fromTimestamp(self, ts):
+        return datetime.fromtimestamp(ts, self.tz)
+
+    # Aware datetime from a naive local datetime
+    def localize(self, dt):
+        return self.tz.localize(dt)
+
+    # Timestamp of the local midnight starting given date
+    def midnight(self, day):
+        return self.tz.localize(datetime.combine(day, datetime.min.time())).timestamp()
+
+    def _currentDay(self):
+        ts = self.now()
+        d = self._day
+        if d is None or not d[0] <= ts < d[1]:
+            day = self.fromTimestamp(ts).date()
+            d = self._day = (self.midnight(day), self.midnight(day + timedelta(days=1)), day, day.strftime('%d%m%y'))
+        return d
+
+    # Local date of today
+    def today(self):
+        return self._currentDay()[2]
+
+    # Key (ddmmyy) of today
+    def todayKey(self):
+        return self._currentDay()[3]
+
+    # Timestamp of next local midnight
+    def nextRollover(self):
+        return self._currentDay()[1]
+
+    # Timestamp of the local midnight starting next month
+    def nextMonthRollover(self):
+        day = self.today()
+        return self.midnight(date(day.year + day.month // 12, day.month % 12 + 1, 1))
+
+    # Seconds elapsed since local midnight
+    def secondsSinceMidnight(self):
+        return self.now() - self._currentDay()[0]
+
+
+# Clock stopped at a given instant (tests, benchmarks). 'at' is a timestamp or a datetime
+# (local if naive)
+class FrozenClock(Clock):
+    def __init__(self, at, tzName=TIMEZONE):
+        super().__init__(tzName)
+        self.set(at)
+
+    def set(self, at):
+        if isinstance(at, datetime):
+            if at.tzinfo is None:
+                at = self.localize(at)
+            at = at.timestamp()
+        self._now = float(at)
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def now(self):
+        return self._now
+
+
+# Clock used by the application
+_clock = Clock()
+
+def getClock():
+    return _clock
+
+def setClock(clock):
+    global _clock
+    _clock = clock
@@ -0,0 +1,62 @@
+# Estimated water height at any instant, interpolated between consecutive high and low waters
+#
+# Between two extremes (t0, h0) and (t1, h1), the height follows half a cosine period:
+#     h(t) = h0 + (h1 - h0) * (1 - cos(pi * (t - t0) / (t1 - t0))) / 2
+# (the continuous form of the rule of twelfths). Whole time series are evaluated at once
+# with NumPy. Instants outside the known extremes have no height (NaN), nor instants between
+# two extremes that are not consecutive tides: of the same type, or further apart than half a
+# tidal cycle (gap in the tides history), where interpolating would invent heights.
+
+import numpy as np
+
+# Max duration between a high and a low water (seconds). Half a semi-diurnal cycle is about
+# 6h12, longer with the diurnal inequality of the mixed tides of Mauritius
+MAX_HALF_CYCLE = 9 * 3600
+
+class TidesCurve:
+    def __init__(self, events):		# Sorted timeline events: (timestamp, type, height, ddmmyy)
+        self._times   = np.array([e[0] for e in events], dtype=np.float64)
+        self._heights = np.array([e[2] for e in events], dtype=np.float64)
+        self._high    = np.array([e[1] == 'high' for e in events], dtype=bool)
+
+    def __len__(self):
+        return len(self._times)
+
+    # Return (heights, rising) for an array of timestamps (seconds since epoch). 'heights' is an
+    # array of floats (NaN if unknown), 'rising' an array of booleans (next extreme is a high water)
+    def evaluate(self, timestamps):
+        ts = np.asarray(timestamps, dtype=np.float64)
+        heights = np.full(ts.shape, np.nan)
+        rising  = np.zeros(ts.shape, dtype=bool)
+        if len(self._times) < 2:
+            return heights, rising
+
+        # Index of the previous extreme of each instant
+        i = np.searchsorted(self._times, ts, side='right') - 1
+        valid = (i >= 0) & (i < len(self._times) - 1) | (ts == self._times[-1])
+        i = np.clip(i, 0, len(self._times) - 2)
+
+        t0, t1 = self._times[i], self._times[i+1]
+        h0, h1 = self._heights[i], self._heights[i+1]
+        # Missing tides between the two extremes: only their own heights are known
+        consecutive = (t1 - t0 <= MAX_HALF_CYCLE) & (self._high[i] != self._high[i+1])
+        valid &= consecutive | (ts == t0) | (ts == t1)
+        span = np.where(t1 > t0, t1 - t0, 1.0)		# Same time: no interpolation
+        phase = np.clip((ts - t0) / span, 0.0, 1.0)
+        h = h0 + (h1 - h0) * (1 - np.cos(np.pi * phase)) / 2
+
+        heights[valid] = h[valid]
+        rising[valid]  = self._high[i+1][valid]
+        return heights, rising
+
+    # Height at one instant (float, or None if unknown) and whether the tide is rising
+    def heightAt(self, timestamp):
+        heights, rising = self.evaluate([timestamp])
+        if np.isnan(heights[0]):
+            return None, None
+        return float(heights[0]), bool(rising[0])
+
+    # Heights from 'start' (timestamp) every 'step' seconds, 'count' points. Unknown heights are None
+    def series(self, start, step, count):
+        heights, rising = self.evaluate(start + step * np.arange(count))
+        return [None if h != h else h for h in np.round(heights, 1).tolist()]	# NaN != NaN
@@ -0,0 +1,106 @@
+# Streaming extractor of the tides table of the metservice.intnet.mu page
+#
+# The page is scanned once by an event-driven parser. Only the rows of the (first) body of
+# the first table are collected, and parsing stops at the end of this body. Rows are
+# returned as soon as they are complete, as lists of cell texts (stripped, as BeautifulSoup
+# .text.strip() would return them).
+
+from html.parser import HTMLParser
+
+# Size of the chunks of the page fed to the parser
+CHUNK_SIZE = 8192
+
+class TidesTableParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows  = list()	# Completed rows, not yet consumed
+        self.done  = False	# End of first table body reached
+        self._depth = 0		# Table nesting level
+        self._inBody = False	# Inside <tbody> of first table
+        self._row  = None	# Cells of current row
+        self._cell = None	# Text fragments of current cell
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'table':
+            self._depth += 1
+        elif self._depth != 1:
+            return		# Outside first table or in a nested table
+        elif tag == 'tbody':
+            self._inBody = True
+        elif not self._inBody:
+            return
+        elif tag == 'tr':
+            self._endRow()	# Implicitly closes the previous row
+            self._row = list()
+        elif tag == 'td':
+            self._endCell()	# Implicitly closes the previous cell
+            if self._row is None:
+                self._row = list()
+            self._cell = list()
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == 'table':
+            self._depth -= 1
+            if self._depth == 0:
+                self._endRow()
+                self.done = True
+        elif self._depth != 1 or not self._inBody:
+            return
+        elif tag == 'td':
+            self._endCell()
+        elif tag == 'tr':
+            self._endRow()
+        elif tag == 'tbody':		# Only the first body is parsed
+            self._endRow()
+            self._inBody = False
+            self.done = True
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def _endCell(self):
+        if self._cell is not None:
+            self._row.append(''.join(self._cell).strip())
+            self._cell = None
+
+    def _endRow(self):
+        self._endCell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+
+# Generator returning the rows (lists of cell texts) of the first table of 'html'
+def iterTableRows(html, chunkSize=CHUNK_SIZE):
+    parser = TidesTableParser()
+    for i in range(0, len(html), chunkSize):
+        parser.feed(html[i:i+chunkSize])
+        rows, parser.rows = parser.rows, list()
+        yield from rows
+        if parser.done:
+            return
+    parser.close()
+    yield from parser.rows
+
+
+# Same, using BeautifulSoup (reference implementation)
+def iterTableRowsBs4(html):
+    from bs4 import BeautifulSoup	# Loaded only when needed
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Assuming the first table *IS* the tides table :(
+    table = soup.find('table')
+    if table is None:
+        return
+    table_body = table.find('tbody') or table
+
+    rows = table_body.find_all('tr')
+    for row in rows:
+        cols = row.find_all('td')
+        yield [ele.text.strip() for ele in cols]
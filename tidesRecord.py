@@ -0,0 +1,132 @@
+# Compact, typed record of the tides of one day
+#
+# Built once when the metservice page is parsed (or when a legacy cache file / history row
+# is read), then used as is by all consumers. Times are minutes since midnight
+# (Mauritius-local), heights are integers (cm), and a missing tide is None.
+#
+# Serialized forms:
+# - record: list of 8 ints/None [high1 time, high1 height, high2 time, high2 height,
+#   low1 time, low1 height, low2 time, low2 height] (cache file, tides history),
+# - legacy list: ['10', '10:05', '55', '22:06', '62', '04:16', '23', '15:55', '27'], with '-'
+#   for a missing tide (CLI output, API compatibility mode).
+
+from datetime import date
+from functools import lru_cache
+
+from common.utils import myprint
+
+# Tides of a day, in record order: (type, index of time in record)
+TIDES = (('high', 0), ('high', 2), ('low', 4), ('low', 6))
+
+# Convert a date key (ddmmyy) to a date ordinal. Raise ValueError if invalid
+@lru_cache(maxsize=4096)
+def dateKeyToOrdinal(tidesDate):
+    if len(tidesDate) != 6 or not tidesDate.isdigit():
+        raise ValueError('Invalid date key: %s' % tidesDate)
+    return date(2000 + int(tidesDate[4:6]), int(tidesDate[2:4]), int(tidesDate[0:2])).toordinal()
+
+# Convert a date ordinal to a date key (ddmmyy)
+def ordinalToDateKey(ordinal):
+    return date.fromordinal(ordinal).strftime('%d%m%y')
+
+# Convert a time ('HH:MM') to minutes since midnight. Raise ValueError if invalid
+def timeToMinutes(t):
+    hh,mm = t.split(':')
+    m = int(hh) * 60 + int(mm)
+    if not 0 <= m < 24 * 60:
+        raise ValueError('Invalid time: %s' % t)
+    return m
+
+# Convert minutes since midnight to a time ('HH:MM')
+def minutesToTime(m):
+    return '%02d:%02d' % divmod(m, 60)
+
+
+class TideDay:
+    __slots__ = ('ordinal',
+                 'highTime1', 'highHeight1', 'highTime2', 'highHeight2',
+                 'lowTime1', 'lowHeight1', 'lowTime2', 'lowHeight2')
+
+    def __init__(self, ordinal, highTime1=None, highHeight1=None, highTime2=None, highHeight2=None,
+                 lowTime1=None, lowHeight1=None, lowTime2=None, lowHeight2=None):
+        self.ordinal     = ordinal
+        self.highTime1   = highTime1
+        self.highHeight1 = highHeight1
+        self.highTime2   = highTime2
+        self.highHeight2 = highHeight2
+        self.lowTime1    = lowTime1
+        self.lowHeight1  = lowHeight1
+        self.lowTime2    = lowTime2
+        self.lowHeight2  = lowHeight2
+
+    # Build from a record (list of 8 ints/None)
+    @classmethod
+    def fromRecord(cls, ordinal, record):
+        return cls(ordinal, *record)
+
+    # Build from a legacy list of strings (date key gives month and year)
+    @classmethod
+    def fromList(cls, tidesDate, info):
+        record = [None] * 8
+        for kind,i in TIDES:
+            try:
+                t = info[i+1].strip()
+                if t == '-':
+                    continue		# phantom tide
+                record[i]   = timeToMinutes(t)
+                record[i+1] = int(info[i+2])
+            except (IndexError, ValueError):
+                myprint(1, 'Invalid tide %s for %s' % (info[i+1:i+3], tidesDate))
+                record[i] = record[i+1] = None
+        return cls(dateKeyToOrdinal(tidesDate), *record)
+
+    # Build from a record or a legacy list (e.g. read from a cache file of a previous version)
+    @classmethod
+    def fromAny(cls, tidesDate, value):
+        if len(value) == 9 and isinstance(value[0], str):
+            return cls.fromList(tidesDate, value)
+        return cls.fromRecord(dateKeyToOrdinal(tidesDate), value)
+
+    def record(self):
+        return [self.highTime1, self.highHeight1, self.highTime2, self.highHeight2,
+                self.lowTime1, self.lowHeight1, self.lowTime2, self.lowHeight2]
+
+    @property
+    def date(self):
+        return date.fromordinal(self.ordinal)
+
+    @property
+    def key(self):
+        return ordinalToDateKey(self.ordinal)
+
+    # List of (minutes, type, height) of the tides of the day, sorted by time
+    def events(self):
+        record = self.record()
+        return sorted((record[i], kind, record[i+1]) for kind,i in TIDES if record[i] is not None)
+
+    # Legacy list of strings
+    def toList(self):
+        record = self.record()
+        l = [str(self.date.day)]
+        for kind,i in TIDES:
+            if record[i] is None:
+                l += ['-', '-']
+            else:
+                l += [minutesToTime(record[i]), str(record[i+1])]
+        return l
+
+    # API output: {'date': ddmmyy, 'high': [tide, tide], 'low': [tide, tide]}, where each tide is
+    # {'time': 'HH:MM', 'minutes': m, 'height': h} or None
+    def toDict(self):
+        record = self.record()
+        d = {'date': self.key, 'high': list(), 'low': list()}
+        for kind,i in TIDES:
+            t = record[i]
+            d[kind].append(None if t is None else {'time': minutesToTime(t), 'minutes': t, 'height': record[i+1]})
+        return d
+
+    def __eq__(self, other):
+        return isinstance(other, TideDay) and self.ordinal == other.ordinal and self.record() == other.record()
+
+    def __repr__(self):
+        return 'TideDay(%s, %s)' % (self.key, self.record())
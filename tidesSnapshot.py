@@ -0,0 +1,105 @@
+# Binary snapshot of the tides table, shared by all worker processes through mmap
+#
+# Written by the refresher next to the local cache file (same generation), with the days of
+# the tides history and of the cache file. Readers map the file and look up a date in O(1):
+# nothing is read or copied but the 16 bytes of the day requested, and the pages of the file
+# are shared by all processes (page cache). The file is replaced atomically: a reader keeps
+# its mapping of the previous snapshot until it opens the new one.
+#
+# Layout (little-endian):
+# - header: magic, format version, record size, generation, ordinal of first day, number of
+#   days, time of update (seconds since epoch),
+# - one record per day from the first day, in date order: 8 int16 (see tidesRecord.py), with
+#   MISSING for a missing tide. A day without any tide (not in the table) is all MISSING.
+
+from collections.abc import Mapping
+import mmap
+import struct
+import time
+
+from common.utils import writeFileAtomic
+from tidesRecord import TideDay, dateKeyToOrdinal, ordinalToDateKey
+
+MAGIC   = b'MMSTIDES'
+VERSION = 1
+HEADER  = struct.Struct('<8sHHQIII')
+RECORD  = struct.Struct('<8h')
+MISSING = -32768
+EMPTY   = (MISSING,) * 8
+
+# Write the snapshot of a tides dict (ddmmyy -> TideDay) to 'path' (atomically).
+# Raise OSError or ValueError
+def writeSnapshot(path, tidesDict, generation):
+    days = sorted(tidesDict.values(), key=lambda d: d.ordinal)
+    first = days[0].ordinal if days else 0
+    count = days[-1].ordinal - first + 1 if days else 0
+
+    buf = bytearray(HEADER.size + count * RECORD.size)
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, RECORD.size, generation, first, count, int(time.time()))
+    for i in range(count):
+        RECORD.pack_into(buf, HEADER.size + i * RECORD.size, *EMPTY)
+    for d in days:
+        try:
+            RECORD.pack_into(buf, HEADER.size + (d.ordinal - first) * RECORD.size,
+                             *[MISSING if v is None else v for v in d.record()])
+        except struct.error as e:
+            raise ValueError('Invalid tides of %s: %s' % (d.key, e))
+    writeFileAtomic(path, bytes(buf))
+
+
+class TidesSnapshot(Mapping):
+    # Map the snapshot file. Raise OSError or ValueError (invalid file)
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, recordSize, self.generation, self.firstOrdinal, self.days, self.updated = HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or version != VERSION or recordSize != RECORD.size or len(self._mm) != HEADER.size + self.days * RECORD.size:
+            self._mm.close()
+            raise ValueError('Invalid tides snapshot %s' % path)
+        self._len = None
+
+    # TideDay of a date ordinal, or None
+    def day(self, ordinal):
+        i = ordinal - self.firstOrdinal
+        if not 0 <= i < self.days:
+            return None
+        record = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        if record == EMPTY:
+            return None
+        return TideDay(ordinal, *[None if v == MISSING else v for v in record])
+
+    def get(self, key, default=None):
+        try:
+            day = self.day(dateKeyToOrdinal(key))
+        except ValueError:
+            return default
+        return default if day is None else day
+
+    def __getitem__(self, key):
+        day = self.get(key)
+        if day is None:
+            raise KeyError(key)
+        return day
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        for i in range(self.days):
+            if RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size) != EMPTY:
+                yield ordinalToDateKey(self.firstOrdinal + i)
+
+    # Without scanning the records (see __len__())
+    def __bool__(self):
+        return self.days > 0
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for k in self)
+        return self._len
+
+    def __repr__(self):
+        return 'TidesSnapshot(generation %d, %d days from %s)' % (self.generation, self.days, ordinalToDateKey(self.firstOrdinal) if self.days else '-')
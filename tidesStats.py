@@ -0,0 +1,134 @@
+# Monthly and yearly tide statistics, computed with NumPy over the whole tides table
+#
+# The table (TideDay records) is converted once to arrays: one row per day, high and low
+# water heights as (days, 2) arrays with NaN for a missing tide. All figures of a month or
+# a year are then computed in bulk on slices of these arrays, and memoized.
+#
+# - daily range: highest high water - lowest low water of the day,
+# - MHW / MLW: mean high / low water heights of the month,
+# - spring / neap days: days of the month whose range is in the top / bottom quartile,
+# - extremes of the year: highest high water, lowest low water, largest and smallest ranges.
+
+import contextlib
+import threading
+import warnings
+
+import numpy as np
+
+from common.utils import myprint
+from tidesRecord import minutesToTime, ordinalToDateKey
+
+# Quantiles of the daily range of a month delimiting neap and spring days
+NEAP_QUANTILE   = 0.25
+SPRING_QUANTILE = 0.75
+
+class TidesStats:
+    def __init__(self, tidesDict):		# ddmmyy -> TideDay
+        days = sorted(tidesDict.values(), key=lambda d: d.ordinal)
+        records = np.array([d.record() for d in days], dtype=np.float64).reshape(-1, 8)	# None -> NaN
+
+        self._ordinals = np.array([d.ordinal for d in days], dtype=np.int64)
+        dates = [d.date for d in days]
+        self._months = np.array([dt.year * 100 + dt.month for dt in dates], dtype=np.int64)	# yyyymm
+        self._highTimes   = records[:, [0, 2]]
+        self._highHeights = records[:, [1, 3]]
+        self._lowTimes    = records[:, [4, 6]]
+        self._lowHeights  = records[:, [5, 7]]
+
+        with _ignoreAllNaN():
+            self._ranges = np.nanmax(self._highHeights, axis=1) - np.nanmin(self._lowHeights, axis=1)
+
+        self._lock  = threading.Lock()
+        self._memo  = dict()		# ('month', yyyymm) or ('year', yyyy) -> result
+        myprint(1, '%d days in statistics table' % len(days))
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def _memoized(self, key, compute):
+        with self._lock:
+            res = self._memo.get(key)
+        if res is None:
+            with _ignoreAllNaN():
+                res = compute()
+            with self._lock:
+                self._memo[key] = res
+        return res
+
+    # Statistics of a month (dict), or None if no data
+    def month(self, year, month):
+        return self._memoized(('month', year * 100 + month), lambda: self._month(year * 100 + month))
+
+    # Statistics of a year (dict), or None if no data
+    def year(self, year):
+        return self._memoized(('year', year), lambda: self._year(year))
+
+    def _month(self, yyyymm):
+        sel = self._months == yyyymm
+        if not sel.any():
+            return None
+        ranges = self._ranges[sel]
+        neap, spring = np.nanquantile(ranges, [NEAP_QUANTILE, SPRING_QUANTILE])
+        kinds = np.where(ranges >= spring, 'spring', np.where(ranges <= neap, 'neap', ''))
+
+        return {
+            'month'     : '%02d%02d' % (yyyymm % 100, yyyymm // 100 % 100),	# mmyy
+            'days'      : int(sel.sum()),
+            'mhw'       : _round(np.nanmean(self._highHeights[sel])),
+            'mlw'       : _round(np.nanmean(self._lowHeights[sel])),
+            'meanRange' : _round(np.nanmean(ranges)),
+            'daily'     : [{'date': ordinalToDateKey(o), 'range': _round(r), 'type': k or None}
+                           for o, r, k in zip(self._ordinals[sel].tolist(), ranges.tolist(), kinds.tolist())],
+        }
+
+    def _year(self, yyyy):
+        sel = self._months // 100 == yyyy
+        if not sel.any():
+            return None
+
+        months = [self.month(yyyy, m) for m in sorted(set((self._months[sel] % 100).tolist()))]
+        return {
+            'year'      : yyyy,
+            'days'      : int(sel.sum()),
+            'mhw'       : _round(np.nanmean(self._highHeights[sel])),
+            'mlw'       : _round(np.nanmean(self._lowHeights[sel])),
+            'meanRange' : _round(np.nanmean(self._ranges[sel])),
+            'months'    : [{k: v for k,v in m.items() if k != 'daily'} for m in months],
+            'extremes'  : {
+                'highestHighWater' : self._extreme(sel, self._highHeights, self._highTimes, np.nanargmax),
+                'lowestLowWater'   : self._extreme(sel, self._lowHeights, self._lowTimes, np.nanargmin),
+                'largestRange'     : self._extremeRange(sel, np.nanargmax),
+                'smallestRange'    : self._extremeRange(sel, np.nanargmin),
+            },
+        }
+
+    # Tide of the selected days with the extreme height (argFunc: nanargmax or nanargmin)
+    def _extreme(self, sel, heights, times, argFunc):
+        h = heights[sel]
+        if np.isnan(h).all():
+            return None
+        i, j = np.unravel_index(argFunc(h), h.shape)
+        return {
+            'date'   : ordinalToDateKey(int(self._ordinals[sel][i])),
+            'time'   : minutesToTime(int(times[sel][i, j])),
+            'height' : int(h[i, j]),
+        }
+
+    def _extremeRange(self, sel, argFunc):
+        r = self._ranges[sel]
+        if np.isnan(r).all():
+            return None
+        i = argFunc(r)
+        return {'date': ordinalToDateKey(int(self._ordinals[sel][i])), 'range': _round(r[i])}
+
+
+def _round(v):
+    v = float(v)
+    return None if v != v else round(v, 1)	# NaN != NaN
+
+# Silence warnings about all-NaN slices (days or months without some tides): results are NaN
+@contextlib.contextmanager
+def _ignoreAllNaN():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        yield
@@ -0,0 +1,116 @@
+# Persistent history of tides information (SQLite database)
+#
+# Each refresh of the local cache is merged into the database, so past months remain
+# available. Rows are indexed by (station, day ordinal): point and range lookups are
+# B-tree searches.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import myGlobals as mg
+from common.utils import myprint
+from tidesRecord import TideDay, dateKeyToOrdinal, ordinalToDateKey
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tides (
+    station TEXT    NOT NULL,
+    day     INTEGER NOT NULL,	-- date ordinal
+    info    TEXT    NOT NULL,	-- JSON record (see tidesRecord.py), as stored in the cache file
+    updated INTEGER NOT NULL,	-- time of last merge (seconds since epoch)
+    PRIMARY KEY (station, day)
+) WITHOUT ROWID
+'''
+
+# Version of the database format (PRAGMA user_version)
+# 0: info is a JSON list of strings (legacy format)
+# 1: info is a JSON record
+SCHEMA_VERSION = 1
+
+
+class TidesStore:
+    def __init__(self, path, station=mg.DEFAULT_STATION):
+        self._path    = path
+        self._station = station
+        self._local   = threading.local()	# One connection per thread (and per process)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+            self._migrate(conn)
+            self._local.conn = conn
+            self._local.pid  = os.getpid()
+        return conn
+
+    # Upgrade the database to the current format. Safe to run concurrently (conversion is idempotent)
+    def _migrate(self, conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with conn:
+            rows = conn.execute('SELECT station, day, info FROM tides').fetchall()
+            conn.executemany('UPDATE tides SET info=? WHERE station=? AND day=?',
+                             [(json.dumps(TideDay.fromAny(ordinalToDateKey(day), json.loads(info)).record()), station, day)
+                              for station, day, info in rows])
+            conn.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+        if rows:	# Not a new database
+            myprint(0, 'Tides history %s upgraded to version %d (%d rows)' % (self._path, SCHEMA_VERSION, len(rows)))
+
+    # Merge a dict of tides information (ddmmyy -> TideDay) into the history. Return the number of rows merged
+    def merge(self, tidesDict, station=None):
+        station = station or self._station
+        now = int(time.time())
+        rows = [(station, v.ordinal, json.dumps(v.record()), now) for v in tidesDict.values()]
+
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO tides (station, day, info, updated) VALUES (?,?,?,?)', rows)
+        myprint(1, '%d entries merged into %s' % (len(rows), self._path))
+        return len(rows)
+
+    # Return tides information (TideDay) for given date (ddmmyy) or None
+    def get(self, tidesDate, station=None):
+        try:
+            day = dateKeyToOrdinal(tidesDate)
+        except ValueError:
+            return None
+        row = self._conn().execute('SELECT info FROM tides WHERE station=? AND day=?',
+                                   (station or self._station, day)).fetchone()
+        return TideDay.fromRecord(day, json.loads(row[0])) if row else None
+
+    # Return a dict (ddmmyy -> info) of tides information found for given dates (ddmmyy), in one query
+    def getMany(self, tidesDates, station=None):
+        days = dict()
+        for k in tidesDates:
+            try:
+                days[dateKeyToOrdinal(k)] = k
+            except ValueError:
+                pass
+        if not days:
+            return dict()
+        cursor = self._conn().execute('SELECT day, info FROM tides WHERE station=? AND day IN (%s)' % ','.join('?' * len(days)),
+                                      (station or self._station, *days))
+        return {days[day]: TideDay.fromRecord(day, json.loads(info)) for day, info in cursor}
+
+    # Generator returning (ddmmyy, info) for each day found in [fromDate, toDate] (ddmmyy)
+    def range(self, fromDate, toDate, station=None):
+        cursor = self._conn().execute('SELECT day, info FROM tides WHERE station=? AND day BETWEEN ? AND ? ORDER BY day',
+                                      (station or self._station, dateKeyToOrdinal(fromDate), dateKeyToOrdinal(toDate)))
+        for day, info in cursor:
+            yield ordinalToDateKey(day), TideDay.fromRecord(day, json.loads(info))
+
+    # Generator returning (ddmmyy, info) for each day in the history
+    def all(self, station=None):
+        cursor = self._conn().execute('SELECT day, info FROM tides WHERE station=? ORDER BY day',
+                                      (station or self._station,))
+        for day, info in cursor:
+            yield ordinalToDateKey(day), TideDay.fromRecord(day, json.loads(info))
+
+    # Number of days in the history
+    def count(self, station=None):
+        return self._conn().execute('SELECT COUNT(*) FROM tides WHERE station=?',
+                                    (station or self._station,)).fetchone()[0]
@@ -0,0 +1,59 @@
+# Sorted timeline of tide events (high/low waters) built once from the tides table (TideDay records)
+#
+# Each event is a tuple (timestamp, type, height, ddmmyy) where timestamp is the
+# Mauritius-local time of the tide in seconds since epoch. Searches are done by bisection.
+
+from bisect import bisect_left
+
+from common.utils import myprint
+from tidesClock import getClock
+
+class TidesTimeline:
+    def __init__(self, tidesDict):		# ddmmyy -> TideDay
+        clock = getClock()
+        events = list()
+        for k,day in tidesDict.items():
+            midnight = clock.midnight(day.date)
+            for minutes,kind,h in day.events():
+                events.append((midnight + minutes * 60, kind, h, k))
+        events.sort()
+
+        self._events = events
+        self._times  = [e[0] for e in events]
+        # Same, per tide type
+        self._byType = dict()
+        for kind in ('high', 'low'):
+            l = [e for e in events if e[1] == kind]
+            self._byType[kind] = (l, [e[0] for e in l])
+        self._curve  = None
+        myprint(1, '%d tide events in timeline' % len(events))
+
+    def __len__(self):
+        return len(self._events)
+
+    # Water height interpolation engine (tidesCurve.TidesCurve). Built on first use
+    def curve(self):
+        if self._curve is None:
+            from tidesCurve import TidesCurve	# Loaded only when needed (NumPy)
+            self._curve = TidesCurve(self._events)
+        return self._curve
+
+    # Return the list of the next n events at or after timestamp 'at', optionally of given type
+    def next(self, at, kind=None, n=1):
+        if kind:
+            events, times = self._byType[kind]
+        else:
+            events, times = self._events, self._times
+        i = bisect_left(times, at)
+        return events[i:i+n]
+
+
+# Convert a timeline event to a dict (API output)
+def eventToDict(event):
+    ts, kind, h, k = event
+    return {
+        'time'   : getClock().fromTimestamp(ts).isoformat(),
+        'type'   : kind,
+        'height' : h,
+        'date'   : k,
+    }
@@ -0,0 +1,141 @@
+# HTTP client used to retrieve pages from the MetService server
+#
+# - one long-lived session (connection pool) for the life of the process,
+# - connect/read timeouts on every request,
+# - retries with exponential backoff and jitter on connection errors, timeouts, truncated or
+#   undecodable bodies and 5xx,
+# - validators (ETag, Last-Modified, body hash) saved per URL, to send conditional requests
+#   and detect unchanged pages.
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from common.utils import myprint, dumpJsonToFile
+
+CONNECT_TIMEOUT = 5	# seconds
+READ_TIMEOUT    = 30	# seconds
+RETRIES         = 3	# Number of retries after a failed attempt
+BACKOFF_BASE    = 1	# seconds. Delay before first retry, doubled on each retry
+BACKOFF_MAX     = 30	# seconds
+
+# Errors of a request worth retrying (a body cut by the server raises ChunkedEncodingError)
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+REQUEST_DURATION = metrics.histogram('upstream_request_duration_seconds', 'Duration of requests to MetService server, retries included')
+RESPONSE_BYTES   = metrics.counter('upstream_response_bytes', 'Size of responses of MetService server')
+RETRIES_COUNT    = metrics.counter('upstream_retries', 'Requests to MetService server retried')
+
+class UpstreamClient:
+    def __init__(self, validatorsPath, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=RETRIES):
+        self._validatorsPath = validatorsPath
+        self._timeout = timeout
+        self._retries = retries
+        self._lock    = threading.Lock()
+        self._session = None
+        self._validators = None		# URL -> {'etag', 'lastModified', 'hash', 'tag'}
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0)
+                s.mount('http://', adapter)
+                s.mount('https://', adapter)
+                self._session = s
+            return self._session
+
+    # Delay before retry number 'attempt' (0 based): exponential backoff with jitter
+    @staticmethod
+    def backoff(attempt):
+        d = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        return d / 2 + random.uniform(0, d / 2)
+
+    # Send a request, retrying on connection errors, timeouts, truncated bodies and server errors (5xx).
+    # Return the response, or raise the last requests.exceptions.RequestException
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        t0 = time.perf_counter()
+        for attempt in range(self._retries + 1):
+            if attempt:
+                RETRIES_COUNT.inc()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self._retries:
+                    self._record(t0, None)
+                    raise
+                myprint(1, 'Request failed (%s). Retrying' % e)
+            else:
+                if r.status_code < 500 or attempt == self._retries:
+                    self._record(t0, r, kwargs.get('stream'))
+                    return r
+                myprint(1, 'Server error %d. Retrying' % r.status_code)
+                r.close()
+            delay = self.backoff(attempt)
+            myprint(1, 'Retry %d/%d in %.1f seconds' % (attempt + 1, self._retries, delay))
+            time.sleep(delay)
+
+    # Record duration, status and size of a request (response is None on error)
+    @staticmethod
+    def _record(t0, response, stream=False):
+        REQUEST_DURATION.observe(time.perf_counter() - t0)
+        status = str(response.status_code) if response is not None else 'error'
+        metrics.counter('upstream_requests', 'Requests to MetService server, by status', status=status).inc()
+        if response is not None:
+            # Streamed content is not read here
+            size = int(response.headers.get('Content-Length', 0)) if stream else len(response.content)
+            RESPONSE_BYTES.inc(size)
+
+    ####
+    def _loadValidators(self):
+        if self._validators is None:
+            try:
+                with open(self._validatorsPath, 'r') as f:
+                    self._validators = json.load(f)
+            except (OSError, ValueError):
+                self._validators = dict()
+        return self._validators
+
+    # Headers of a conditional request for 'url'. Validators are only used if they were
+    # saved with the same 'tag' (caller-defined context, e.g. the current month)
+    def conditionalHeaders(self, url, tag):
+        v = self._loadValidators().get(url)
+        if not v or v.get('tag') != tag:
+            return dict()
+        hdrs = dict()
+        if v.get('etag'):
+            hdrs['If-None-Match'] = v['etag']
+        if v.get('lastModified'):
+            hdrs['If-Modified-Since'] = v['lastModified']
+        return hdrs
+
+    # True if 'body' is identical to the last body saved for 'url' with same 'tag'
+    def isUnchanged(self, url, body, tag):
+        v = self._loadValidators().get(url)
+        return bool(v) and v.get('tag') == tag and v.get('hash') == bodyHash(body)
+
+    # Save the validators of a response successfully processed
+    def saveValidators(self, url, response, tag):
+        self._loadValidators()[url] = {
+            'etag'         : response.headers.get('ETag'),
+            'lastModified' : response.headers.get('Last-Modified'),
+            'hash'         : bodyHash(response.content),
+            'tag'          : tag,
+        }
+        dumpJsonToFile(self._validatorsPath, self._validators)
+
+
+def bodyHash(body):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()